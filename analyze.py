@@ -1,6 +1,12 @@
 #!/bin/python3
 
+import argparse
+import io
+import multiprocessing
+import os
+import time
 import yaml
+from contextlib import redirect_stdout
 from utils import (
     prompt,
     checklist_prompt,
@@ -9,19 +15,22 @@ from utils import (
 from main import (
     SETTINGS_FILE,
     yaspin,
-    db_dir,
+    entry_store,
     settings,
 )
 from models import (
     ALL_MODELS,
+    get_model,
 )
 from models.base import (
     Corpus,
     ModelStatus,
 )
-from models.feed import (
-    FeedEntry,
+from models.store import (
+    load_entries,
 )
+import tracing
+from tracing import span
 
 HELP_STRING = """
 INSTRUCTIONS:
@@ -38,31 +47,116 @@ sqrt(P*R) => 45%
 MODELS:
 """ + '\n'.join([f"- {model.NAME} Model\n  {model.DESCRIPTION}" for model in ALL_MODELS]) + "\n"
 
-def load_corpus():
+def load_corpus(workers: int = 0, processes: bool = False, store=None):
+    if store is None:
+        store = entry_store
     corpus = Corpus()
-    with yaspin(text='Loading...'):
-        for fd in db_dir.iterdir():
-            if fd.name.endswith('.json'):
-                corpus.add_entry(FeedEntry(json_file=fd))
+    started_at = time.time()
+    count = 0
+    with yaspin(text='Loading...') as spinner, span('load'):
+        for entry in load_entries(store, workers=workers, processes=processes):
+            corpus.add_entry(entry)
+            count += 1
+            if count % 1000 == 0:
+                spinner.text = f"Loading... ({count} posts)"
+    elapsed = time.time() - started_at
+    print(f"Loaded {count} posts in {elapsed:.2f} seconds ({count/max(elapsed, 1e-9):.0f} posts/s)")
     return corpus
 
-if __name__ == '__main__':
-    corpus = load_corpus()
-    models = [MC(corpus) for MC in ALL_MODELS]
+def _analyze_in_background(model):
+    """Runs in a worker process and returns the analyzed model and its output"""
+    log = io.StringIO()
+    # Forget any spans inherited from the parent process
+    tracing.drain()
+    with redirect_stdout(log), span('analyze', model=model.NAME):
+        model.analyze()
+    # The parent process already has the corpus, so don't send it back
+    model.corpus = None
+    # Off a tty, spinners redraw themselves with carriage returns
+    log = '\n'.join(line.rsplit('\r', 1)[-1] for line in log.getvalue().split('\n'))
+    return model, log, tracing.drain()
+
+class BackgroundAnalyzer:
+    """Analyzes every unanalyzed model in a process pool while the menu is up"""
+
+    def __init__(self, models: list, corpus: Corpus):
+        self.models = models
+        self.corpus = corpus
+        self.pool = multiprocessing.Pool(processes=min(len(models), os.cpu_count()))
+        self.pending = {
+            i: self.pool.apply_async(_analyze_in_background, (model,))
+            for i, model in enumerate(models)
+            if model.status == ModelStatus.Unanalyzed
+        }
+        self.logs = {}
+
+    def is_pending(self, i: int):
+        return i in self.pending
+
+    def collect(self, wait_for: int = None):
+        """Swaps finished models into self.models, optionally waiting for one"""
+        for i, result in list(self.pending.items()):
+            if i == wait_for:
+                with yaspin(text=f"Waiting for the {self.models[i].NAME} to finish..."):
+                    result.wait()
+            if not result.ready():
+                continue
+            del self.pending[i]
+            try:
+                model, log, spans = result.get()
+            except Exception as e:
+                self.logs[i] = f"Background analysis failed ({e}). Analyzing it here instead.\n"
+                continue
+            model.corpus = self.corpus
+            tracing.merge(spans)
+            self.models[i] = model
+            self.logs[i] = log
+
+    def pop_log(self, i: int):
+        return self.logs.pop(i, '')
+
+    def close(self):
+        self.pool.terminate()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train a custom filter for your feed.")
+    parser.add_argument(
+        '--loader', choices=['serial', 'threads', 'processes'], default='serial',
+        help="How to decode the saved posts (default: serial)")
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help="Pool size for the threads and processes loaders")
+    parser.add_argument(
+        '--background', action='store_true',
+        help="Start analyzing every model in parallel as soon as the posts load")
+    parser.add_argument(
+        '--search', type=float, default=0, metavar='SECONDS',
+        help="Let the Linear Regressor spend up to SECONDS searching for better hyperparameters")
+    tracing.add_arguments(parser)
+    return parser.parse_args()
+
+def main_menu(models: list, background: BackgroundAnalyzer = None):
     while True:
+        if background:
+            background.collect()
         print("Choose a model:")
         options = [
-            f"{model.NAME} ({model.get_status_summary()})" for model in models]
+            f"{model.NAME} ({'Analyzing...' if background and background.is_pending(i) else model.get_status_summary()})"
+            for i, model in enumerate(models)]
         options.extend(["Help", "Exit (No change)"])
         selection = radio_dial(options)
         if selection < len(models):
+            if background:
+                background.collect(wait_for=selection)
+                print(background.pop_log(selection), end='')
             selected_model = models[selection]
             if selected_model.status == ModelStatus.Invalid:
                 print(
                     f"This model requires at least {selected_model.MIN_DATA} to use.")
                 continue
             if selected_model.status == ModelStatus.Unanalyzed:
-                selected_model.analyze()
+                with span('analyze', model=selected_model.NAME):
+                    selected_model.analyze()
             if selected_model.status == ModelStatus.Analyzed:
                 if selected_model.is_refinable() and prompt(
                         "Would you like to refine this model?"):
@@ -81,3 +175,18 @@ if __name__ == '__main__':
                 continue
             case 1:
                 quit(0)
+
+if __name__ == '__main__':
+    args = parse_args()
+    tracing.enable_from_args(args)
+    get_model('LinearModel').SEARCH_BUDGET = args.search
+    corpus = load_corpus(
+        workers=0 if args.loader == 'serial' else args.workers,
+        processes=args.loader == 'processes')
+    models = [MC(corpus) for MC in ALL_MODELS]
+    background = BackgroundAnalyzer(models, corpus) if args.background else None
+    try:
+        main_menu(models, background)
+    finally:
+        if background:
+            background.close()
@@ -0,0 +1,46 @@
+#!/bin/python3
+"""Peak memory while LinearModel analyzes a large corpus
+
+python -m benchmarks.analyze_memory [N] [SOUP_CACHE_SIZE]
+
+Pass a SOUP_CACHE_SIZE of "none" to keep every parsed summary alive."""
+
+import atexit
+import os
+import resource
+import shutil
+import sys
+import tempfile
+
+# LinearModel.analyze caches its work in ~/.feedburnerburner, so keep
+# it away from the real one (and its cached model) in a scratch HOME
+SCRATCH_HOME = tempfile.mkdtemp(prefix='fbb-bench-')
+os.environ['HOME'] = SCRATCH_HOME
+atexit.register(shutil.rmtree, SCRATCH_HOME, ignore_errors=True)
+
+from models.base import Corpus
+from models.feed import soup_cache
+from models.linear import LinearModel
+
+from .synthetic import SyntheticFeed
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    if len(sys.argv) > 2:
+        soup_cache.maxsize = None if sys.argv[2] == 'none' else int(sys.argv[2])
+    corpus = Corpus()
+    for entry in SyntheticFeed().entries(n):
+        corpus.add_entry(entry)
+    before = peak_rss_mib()
+    model = LinearModel(corpus)
+    model.analyze()
+    after = peak_rss_mib()
+    print(f"{n} posts (soup cache size {soup_cache.maxsize}):")
+    print(f"  peak RSS after loading:   {before:.1f} MiB")
+    print(f"  peak RSS after analyzing: {after:.1f} MiB (+{after-before:.1f} MiB)")
@@ -0,0 +1,73 @@
+#!/bin/python3
+"""How much memory does a loaded Corpus take?
+
+python -m benchmarks.memory [N]
+
+Compares the FeedEntry from before __slots__ (every field in a
+per-instance __dict__, summary always loaded) against today's, with and
+without lazy summaries, so the two savings can be told apart."""
+
+import gc
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from models.base import Corpus
+from models.feed import FeedEntry, guid_to_fbbid
+from models.store import SQLiteStore, load_entries
+
+from .synthetic import write_store
+
+
+class DictFeedEntry:
+    """How FeedEntry held a post before __slots__"""
+
+    def __init__(self, data: dict, store=None):
+        self.store = store
+        self.file_path = None
+        self.feed = data.get('feed')
+        self.title = data.get('title')
+        self.summary = data.get('summary')
+        self.author = data.get('author')
+        self.link = data.get('link')
+        self.guid = data.get('guid')
+        self.timestamp = data.get('timestamp')
+        self.tags = data.get('tags')
+        self.status = data.get('status')
+        self.clicked_links = data.get('clicked_links') or []
+
+    @property
+    def fbbid(self):
+        return guid_to_fbbid(self.guid, self.feed)
+
+
+def corpus_footprint(entries) -> int:
+    gc.collect()
+    tracemalloc.start()
+    corpus = Corpus()
+    for entry in entries():
+        corpus.add_entry(entry)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del corpus
+    return size
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp:
+        store = write_store(SQLiteStore(Path(tmp).joinpath('bench.sqlite3')), n)
+        results = {
+            'dict, eager (before)': corpus_footprint(lambda: (
+                DictFeedEntry(store.decode(row), store) for row in store.sources())),
+            '__slots__, eager': corpus_footprint(lambda: (
+                FeedEntry(data=store.decode(row), store=store) for row in store.sources())),
+            '__slots__, lazy': corpus_footprint(lambda: load_entries(store, lazy=True)),
+        }
+        store.close()
+    before = results['dict, eager (before)']
+    for name, size in results.items():
+        print(f"{n} posts, {name:21} {size/2**20:7.1f} MiB ({size/n:.0f} B/post, {100.0*(before-size)/before:.0f}% smaller)")
+    slots, lazy = results['__slots__, eager'], results['__slots__, lazy']
+    print(f"__slots__ alone saves {100.0*(before-slots)/before:.0f}%, lazy summaries a further {100.0*(slots-lazy)/slots:.0f}%")
@@ -0,0 +1,65 @@
+#!/bin/python3
+"""Load time of a trained LinearModel: compressed pickles vs mmapped weights
+
+python -m benchmarks.model_load [N]"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+
+# LinearModel.analyze caches its work in ~/.feedburnerburner, so keep
+# it away from the real one (and its cached model) in a scratch HOME
+SCRATCH_HOME = tempfile.mkdtemp(prefix='fbb-bench-')
+os.environ['HOME'] = SCRATCH_HOME
+atexit.register(shutil.rmtree, SCRATCH_HOME, ignore_errors=True)
+
+from models.base import Corpus
+from models.linear import LinearModel
+from models.weights import LinearWeights
+
+from .synthetic import SyntheticFeed
+
+
+def best_of(f, repeat=5) -> float:
+    ret = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        f()
+        ret = min(ret, time.perf_counter() - started_at)
+    return ret
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    corpus = Corpus()
+    for entry in SyntheticFeed().entries(n):
+        corpus.add_entry(entry)
+    model = LinearModel(corpus)
+    model.analyze()
+    post = next(iter(corpus.unseen))
+    text = post.get_text_for_training()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        joblib.dump(model.vectorizer, tmp.joinpath('vectorizer.pkl'), compress=True)
+        joblib.dump(model.model, tmp.joinpath('model.pkl'), compress=True)
+        model.weights.save(tmp.joinpath('weights'))
+
+        def load_pickles():
+            vectorizer = joblib.load(tmp.joinpath('vectorizer.pkl'))
+            regressor = joblib.load(tmp.joinpath('model.pkl'))
+            regressor.decision_function(vectorizer.transform([text]))
+
+        def load_weights():
+            LinearWeights.load(tmp.joinpath('weights')).decision_function([text])
+
+        pickles = best_of(load_pickles)
+        weights = best_of(load_weights)
+    print(f"{len(model.weights.vocabulary)} terms, load + score one post:")
+    print(f"  compressed pickles: {pickles*1000:.1f} ms")
+    print(f"  mmapped weights:    {weights*1000:.1f} ms ({pickles/weights:.0f}x)")
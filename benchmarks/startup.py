@@ -0,0 +1,69 @@
+#!/bin/python3
+"""How long `import main` takes, per python -X importtime
+
+Exits non-zero if the reader takes longer than TARGET_MS to start
+(before any model is loaded), so it can be run as a check.
+
+python -m benchmarks.startup [RUNS]"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from models import MODEL_MODULES
+
+TARGET_MS = 300
+ROOT = Path(__file__).parent.parent
+
+
+def import_times(code: str, home: str) -> dict:
+    """Runs code in a fresh interpreter and returns {module: cumulative µs}"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT,
+        env={**os.environ, 'HOME': home},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    ret = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Nested imports are indented, so keep the outermost (largest) one
+        module = module.strip()
+        ret[module] = max(ret.get(module, 0), int(cumulative))
+    return ret
+
+
+def best_of(code: str, home: str, runs: int) -> dict:
+    ret = {}
+    for _ in range(runs):
+        for module, us in import_times(code, home).items():
+            ret[module] = min(ret.get(module, us), us)
+    return ret
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    # Importing settings creates ~/.feedburnerburner, so use a throwaway HOME
+    with tempfile.TemporaryDirectory() as home:
+        times = best_of('import main', home, runs)
+        startup = times['main'] / 1000
+        print(f"import main: {startup:.0f} ms (target {TARGET_MS} ms)")
+        print("Slowest top-level imports:")
+        top_level = {m: us for m, us in times.items() if '.' not in m and m != 'main'}
+        for module, us in sorted(top_level.items(), key=lambda i: -i[1])[:8]:
+            print(f"  {module:20} {us/1000:7.1f} ms")
+        print("Loading each model's code on top of that:")
+        for name in MODEL_MODULES:
+            # What get_model(name) does, minus importlib (which importtime can't see)
+            module = 'models' + MODEL_MODULES[name]
+            times = best_of(f"import main; import {module}", home, runs)
+            print(f"  {name:20} {times.get(module, 0)/1000:7.1f} ms")
+    if startup > TARGET_MS:
+        print(f"FAIL: startup is {startup - TARGET_MS:.0f} ms over budget")
+        sys.exit(1)
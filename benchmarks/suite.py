@@ -0,0 +1,172 @@
+#!/bin/python3
+"""Times loading, training, scoring and persistence on synthetic corpora
+
+python -m benchmarks.suite [--sizes 1000 10000 100000] [--save FILE] [--compare FILE]
+
+--save writes the timings to a JSON baseline. --compare reruns the
+suite and fails if any benchmark got slower than the baseline by more
+than --threshold (a ratio, default 1.25)."""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+# Importing settings creates ~/.feedburnerburner, and the models cache
+# their work there, so keep all of that in a scratch HOME
+SCRATCH_HOME = tempfile.mkdtemp(prefix='fbb-bench-')
+os.environ['HOME'] = SCRATCH_HOME
+
+from analyze import load_corpus
+from models.linear import LinearModel
+from models.metadata import TagModel
+from models.store import JSONDirStore, SQLiteStore
+from models.text import (
+    STEM_MEMO_FNAME,
+    TOKEN_CACHE_FNAME,
+    StemMemo,
+    nltk_stemmer,
+    nltk_tokenizer,
+)
+from settings import db_dir
+from utils import FileSyncedSet
+import models.text
+
+from .synthetic import write_store
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_THRESHOLD = 1.25
+
+
+def timed(f, *args):
+    """Returns f's result and how many seconds it took, hiding its output"""
+    with redirect_stdout(io.StringIO()):
+        started_at = time.perf_counter()
+        ret = f(*args)
+        elapsed = time.perf_counter() - started_at
+    return ret, elapsed
+
+
+def cold_linear_model(corpus):
+    # Forget every cache, so this measures a from-scratch training run
+    for fname in (LinearModel.CACHE_DIRNAME, TOKEN_CACHE_FNAME, STEM_MEMO_FNAME):
+        path = db_dir.joinpath(fname)
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+    models.text.stem_memo = StemMemo(nltk_stemmer().stem)
+    model = LinearModel(corpus)
+    model.analyze()
+    return model
+
+
+def tag_model(corpus):
+    model = TagModel(corpus)
+    model.analyze()
+    return model
+
+
+def synced_set_churn(n: int, path):
+    """Add n items, remove half, re-add a quarter and reload"""
+    items = [f"tag=metafilter.com_2005_site.{i}" for i in range(n)]
+    removals = random.Random(0).sample(items, n // 2)
+    s = FileSyncedSet(path)
+    for item in items:
+        s.add(item)
+    for item in removals:
+        s.remove(item)
+    for item in removals[:n // 4]:
+        s.add(item)
+    return FileSyncedSet(path)
+
+
+def run_size(n: int) -> dict:
+    ret = {}
+    scratch = db_dir.joinpath(f"bench-{n}")
+    scratch.mkdir()
+    try:
+        json_store = write_store(JSONDirStore(scratch), n)
+        corpus, ret['load_corpus[json]'] = timed(load_corpus, 0, False, json_store)
+        sqlite_store = write_store(SQLiteStore(scratch.joinpath('entries.sqlite3')), n)
+        _, ret['load_corpus[sqlite]'] = timed(load_corpus, 0, False, sqlite_store)
+        sqlite_store.close()
+        unseen = list(corpus.unseen)
+        tags, ret['TagModel.analyze'] = timed(tag_model, corpus)
+        _, ret['TagModel.split_and_rank_posts'] = timed(tags.split_and_rank_posts, unseen)
+        linear, ret['LinearModel.analyze'] = timed(cold_linear_model, corpus)
+        _, ret['LinearModel.split_and_rank_posts'] = timed(linear.split_and_rank_posts, unseen)
+        _, ret['FileSyncedSet churn'] = timed(
+            synced_set_churn, n, scratch.joinpath('unread.tsv'))
+    finally:
+        shutil.rmtree(scratch)
+    return ret
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints each timing next to its baseline and returns the regressions"""
+    regressions = []
+    for key, seconds in results.items():
+        before = baseline.get(key)
+        if before is None:
+            print(f"  {key:45} {seconds:8.3f}s   (new)")
+            continue
+        ratio = seconds / before if before else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f"  {key:45} {seconds:8.3f}s vs {before:8.3f}s  {ratio:5.2f}x{flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Corpus sizes to benchmark (default: %(default)s)")
+    parser.add_argument('--save', metavar='FILE',
+                        help="Write the timings to FILE as a baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare the timings against the baseline in FILE")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Slowdown ratio that counts as a regression (default: %(default)s)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {}
+    # Don't charge the first LinearModel run for importing nltk
+    nltk_stemmer(), nltk_tokenizer()
+    try:
+        for n in args.sizes:
+            print(f"Benchmarking {n} posts...")
+            for name, seconds in run_size(n).items():
+                results[f"{name}@{n}"] = seconds
+                print(f"  {name:40} {seconds:8.3f}s")
+    finally:
+        shutil.rmtree(SCRATCH_HOME)
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, fd, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)['results']
+        print(f"Compared to {args.compare}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks are more than {args.threshold}x slower")
+            sys.exit(1)
+        print("No regressions")
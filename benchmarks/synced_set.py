@@ -0,0 +1,52 @@
+#!/bin/python3
+"""Add/remove throughput of FileSyncedSet, against rewriting the file on every removal
+
+python -m benchmarks.synced_set [N]"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from utils import FileSyncedSet
+
+
+class RewritingSet(FileSyncedSet):
+    """How FileSyncedSet.remove used to work"""
+
+    def remove(self, item):
+        item = self.norm(item)
+        if item not in self.items:
+            return
+        self.items.remove(item)
+        self._rewrite_file()
+
+
+def ops_per_second(f, items) -> float:
+    started_at = time.perf_counter()
+    for item in items:
+        f(item)
+    return len(items) / (time.perf_counter() - started_at)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    items = [f"tag=metafilter.com_2024_site.{i}" for i in range(n)]
+    removals = random.Random(0).sample(items, len(items))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp).joinpath('unread.tsv')
+        s = FileSyncedSet(path)
+        adds = ops_per_second(s.add, items)
+        removes = ops_per_second(s.remove, removals[:n//2])
+        reloaded = FileSyncedSet(path)
+        assert reloaded.items == s.items
+        print(f"{n} items: {adds:,.0f} adds/s, {removes:,.0f} removes/s")
+        print(f"  {path.stat().st_size/1024:,.0f} KiB on disk after removing half")
+        path.unlink()
+        s = RewritingSet(path)
+        for item in items:
+            s.add(item)
+        # Each removal rewrites everything, so a sample is plenty
+        old = ops_per_second(s.remove, removals[:100])
+        print(f"  rewriting the file on each removal: {old:,.0f} removes/s ({removes/old:,.0f}x slower)")
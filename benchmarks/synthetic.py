@@ -0,0 +1,94 @@
+#!/bin/python3
+"""Realistic-looking fake MetaFilter posts for benchmarking
+
+Posts draw their words and tags from Zipfian vocabularies and a handful
+of "favorite" tags and domains make a post more likely to be liked, so
+the models have some signal to find."""
+
+import random
+from pathlib import Path
+
+from models.feed import FeedEntry
+
+SYLLABLES = [
+    'ka', 'lo', 'mi', 'ther', 'an', 'sto', 'ry', 'pe', 'vin', 'dra',
+    'shu', 'el', 'or', 'tic', 'al', 'ment', 'ness', 'ing', 'ba', 'quo',
+]
+DOMAINS = [
+    'youtube.com', 'nytimes.com', 'wikipedia.org', 'theguardian.com',
+    'archive.org', 'bbc.co.uk', 'github.com', 'medium.com', 'npr.org',
+    'atlasobscura.com', 'vimeo.com', 'wired.com', 'reddit.com',
+    'smithsonianmag.com', 'arstechnica.com', 'nautil.us',
+]
+STATUSES = ['liked', 'disliked', 'skipped', 'unread']
+
+
+def _vocabulary(rng: random.Random, size: int) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4))))
+    return sorted(words)
+
+
+class SyntheticFeed:
+    def __init__(self, seed=0, vocab_size=5000, tag_count=800):
+        self.rng = random.Random(seed)
+        self.words = _vocabulary(self.rng, vocab_size)
+        self.tags = _vocabulary(self.rng, tag_count)
+        # Zipfian weights: the k-th most common item has weight 1/k
+        self.word_weights = [1.0 / (k + 1) for k in range(vocab_size)]
+        self.tag_weights = [1.0 / (k + 1) for k in range(tag_count)]
+        self.favorite_tags = set(self.rng.sample(self.tags[:100], 10))
+        self.favorite_domains = set(self.rng.sample(DOMAINS, 3))
+
+    def _sentence(self, n):
+        return ' '.join(self.rng.choices(self.words, self.word_weights, k=n))
+
+    def _link(self, domain):
+        path = '-'.join(self.rng.choices(self.words, self.word_weights, k=3))
+        return f"https://www.{domain}/{path}"
+
+    def entry_data(self, i: int) -> dict:
+        rng = self.rng
+        tags = list(set(rng.choices(self.tags, self.tag_weights,
+                                    k=rng.randint(1, 8))))
+        domains = rng.choices(DOMAINS, k=rng.randint(1, 4))
+        links = [self._link(d) for d in domains]
+        summary = ' '.join(
+            f"<a href=\"{url}\">{self._sentence(rng.randint(2, 6))}</a> "
+            f"{self._sentence(rng.randint(10, 60))}."
+            for url in links)
+        if rng.random() < 0.3:
+            summary += "<br><br>[via <a href=\"https://www.metafilter.com/\">mefi</a>]"
+        signal = len(self.favorite_tags.intersection(tags)) + \
+            len(self.favorite_domains.intersection(domains))
+        if rng.random() < 0.08:
+            status = 'unread'
+        elif rng.random() < 0.05 + 0.4 * signal:
+            status = 'liked'
+        else:
+            status = rng.choice(['disliked', 'disliked', 'skipped'])
+        clicked = []
+        if status in ('liked', 'disliked'):
+            clicked = rng.sample(links, rng.randint(1, len(links)))
+        return {
+            'title': self._sentence(rng.randint(3, 10)).capitalize(),
+            'summary': summary,
+            'author': rng.choice(self.words),
+            'link': f"https://www.metafilter.com/{200000 + i}/",
+            'guid': f"tag:metafilter.com,2005:site.{200000 + i}",
+            'timestamp': 1600000000 + 3600 * i,
+            'tags': tags,
+            'status': status,
+            'clicked_links': clicked,
+        }
+
+    def entries(self, n: int, store=None) -> list[FeedEntry]:
+        return [FeedEntry(data=self.entry_data(i), store=store)
+                for i in range(n)]
+
+
+def write_store(store, n: int, seed=0):
+    """Fills store with n synthetic posts"""
+    store.save_many(SyntheticFeed(seed).entries(n))
+    return store
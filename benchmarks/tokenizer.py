@@ -0,0 +1,41 @@
+#!/bin/python3
+"""Tokens per second with and without the stem memo
+
+python -m benchmarks.tokenizer [N]"""
+
+import sys
+import time
+
+from models.text import (
+    StemMemo,
+    nltk_stemmer,
+    nltk_tokenizer,
+)
+
+from .synthetic import SyntheticFeed
+
+
+def tokenize_all(texts: list[str], stem) -> int:
+    count = 0
+    tokenizer = nltk_tokenizer()
+    for text in texts:
+        tokens = tokenizer.tokenize(text)
+        tokens = [t[:-1] if t.endswith('.') else t for t in tokens]
+        count += len([stem(token) for token in tokens])
+    return count
+
+
+def tokens_per_second(texts: list[str], stem) -> float:
+    started_at = time.time()
+    count = tokenize_all(texts, stem)
+    return count / (time.time() - started_at)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    texts = [e.get_text_for_training() for e in SyntheticFeed().entries(n)]
+    plain = tokens_per_second(texts, nltk_stemmer().stem)
+    memo = StemMemo(nltk_stemmer().stem)
+    memoized = tokens_per_second(texts, memo.stem)
+    print(f"{n} posts, plain Snowball: {plain:,.0f} tokens/s")
+    print(f"{n} posts, stem memo:      {memoized:,.0f} tokens/s ({memoized/plain:.1f}x, hit rate {memo.hit_rate*100:.1f}%)")
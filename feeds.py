@@ -0,0 +1,170 @@
+#!/bin/python3
+
+import json
+import re
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+
+import feedparser
+
+from tracing import span
+
+FEED_CACHE_DIRNAME = 'feeds'
+USER_AGENT = 'feedburnerburner/0.1'
+DEFAULT_FEED_NAME = 'Metafilter'
+METAFILTER_HOST = 'feeds.feedburner.com'
+METAFILTER_PATH = '/metafilter'
+DEFAULT_FEEDS = [
+    {'name': DEFAULT_FEED_NAME, 'url': f"https://{METAFILTER_HOST}/Metafilter"},
+]
+DEFAULT_TIMEOUT = 10
+
+
+class FeedCache:
+    """The last copy of a feed we downloaded and its HTTP cache validators
+
+    A new copy's validators are only written by commit(), once its posts
+    have been saved. Until then the next fetch isn't conditional on them,
+    so a crash in between can't turn that copy into a 304."""
+
+    def __init__(self, cache_dir: Path, name: str):
+        cache_dir.mkdir(exist_ok=True)
+        self.raw_path = cache_dir.joinpath(f"{name}.xml")
+        self.meta_path = cache_dir.joinpath(f"{name}.meta")
+        self.pending = None
+
+    def conditional_headers(self) -> dict:
+        if not (self.meta_path.exists() and self.raw_path.exists()):
+            return {}
+        meta = json.loads(self.meta_path.read_text())
+        ret = {}
+        if meta.get('etag'):
+            ret['If-None-Match'] = meta['etag']
+        if meta.get('modified'):
+            ret['If-Modified-Since'] = meta['modified']
+        return ret
+
+    def load_raw(self) -> bytes:
+        if not self.raw_path.exists():
+            return None
+        return self.raw_path.read_bytes()
+
+    def save(self, raw: bytes, etag: str = None, modified: str = None):
+        """Keeps raw for offline launches, holding its validators until commit()"""
+        # The old validators describe the old copy, so drop them first
+        self.meta_path.unlink(missing_ok=True)
+        self.raw_path.write_bytes(raw)
+        self.pending = {
+            'etag': etag,
+            'modified': modified,
+        }
+
+    def commit(self):
+        """Call once everything in the saved copy has been ingested"""
+        if self.pending is not None:
+            self.meta_path.write_text(json.dumps(self.pending))
+            self.pending = None
+
+
+def fetch_feed(url: str, cache: FeedCache, timeout: float = 10):
+    """Downloads and parses the feed at url if it changed since last time
+
+    Returns None if the server says nothing has changed (HTTP 304).
+    If the server can't be reached, falls back to the cached copy."""
+    with span('fetch', url=url):
+        request = urllib.request.Request(url, headers={
+            'User-Agent': USER_AGENT,
+            **cache.conditional_headers(),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                raw = response.read()
+                etag = response.headers.get('ETag')
+                modified = response.headers.get('Last-Modified')
+        except HTTPError as e:
+            if e.code == 304:
+                return None
+            print(f"WARNING: {url} returned HTTP {e.code}. Using the cached copy.")
+            return _parse_cached(cache)
+        except (URLError, OSError) as e:
+            print(f"WARNING: Couldn't reach {url} ({e}). Using the cached copy.")
+            return _parse_cached(cache)
+        feed = feedparser.parse(raw)
+        cache.save(raw, etag=etag, modified=modified)
+        return feed
+
+
+def _parse_cached(cache: FeedCache):
+    raw = cache.load_raw()
+    if raw is None:
+        return None
+    return feedparser.parse(raw)
+
+
+def is_metafilter(url: str) -> bool:
+    """Whether url is the MetaFilter feed, whose posts predate namespacing"""
+    parsed = urlparse(url)
+    return (parsed.hostname or '').lower() == METAFILTER_HOST \
+        and parsed.path.rstrip('/').lower() == METAFILTER_PATH
+
+
+def default_feed_name(url: str) -> str:
+    """e.g. feeds_feedburner_com_AskMetafilter for https://feeds.feedburner.com/AskMetafilter"""
+    parsed = urlparse(url)
+    name = f"{parsed.hostname or ''}{parsed.path}"
+    if parsed.query:
+        name += f"_{parsed.query}"
+    return name
+
+
+def configured_feeds(settings: dict) -> list[dict]:
+    """Normalizes the `feeds` list in settings.yaml
+
+    Each item may be a bare URL or a mapping with a `url` and optionally
+    a `name` and a `timeout` (in seconds). The returned dicts always have
+    all three, plus the `namespace` to file the feed's posts under.
+    Raises ValueError if two feeds end up with the same name, as they
+    would share a cache and a namespace."""
+    ret = []
+    seen = {}
+    for feed in settings.get('feeds') or DEFAULT_FEEDS:
+        if isinstance(feed, str):
+            feed = {'url': feed}
+        name = feed.get('name') or (
+            DEFAULT_FEED_NAME if is_metafilter(feed['url']) else default_feed_name(feed['url']))
+        name = re.sub(r'[^A-Za-z0-9_-]+', '_', name).strip('_')
+        # Compared case-insensitively, as the cache files may be
+        if name.lower() in seen:
+            raise ValueError(
+                f"The feeds {seen[name.lower()]} and {feed['url']} are both named \"{name}\". "
+                "Give one of them a different `name` in settings.yaml.")
+        seen[name.lower()] = feed['url']
+        ret.append({
+            'url': feed['url'],
+            'name': name,
+            'timeout': feed.get('timeout', DEFAULT_TIMEOUT),
+            # MetaFilter posts predate namespacing and keep their old ids
+            'namespace': None if is_metafilter(feed['url']) else name,
+        })
+    return ret
+
+
+def fetch_all(feeds: list[dict], cache_dir: Path) -> list:
+    """Fetches every feed at once, returning (feed, parsed or None, FeedCache) triples
+
+    The results are in the same order as feeds, and the whole thing takes
+    about as long as the slowest feed (which is bounded by its timeout).
+    Commit each cache once that feed's posts have been saved."""
+    if not feeds:
+        return []
+    with ThreadPoolExecutor(max_workers=len(feeds)) as pool:
+        caches = [FeedCache(cache_dir, feed['name']) for feed in feeds]
+        futures = [
+            pool.submit(fetch_feed, feed['url'], cache, timeout=feed['timeout'])
+            for feed, cache in zip(feeds, caches)
+        ]
+        return [(feed, future.result(), cache)
+                for feed, future, cache in zip(feeds, futures, caches)]
@@ -1,4 +1,5 @@
 #!/bin/python3
+import argparse
 from pathlib import Path
 import yaml
 
@@ -7,8 +8,20 @@ from utils import (
     prompt,
     radio_dial
 )
-from models import MODELS
+from feeds import (
+    FEED_CACHE_DIRNAME,
+    configured_feeds,
+    fetch_all,
+)
+from models import get_model
 from models.feed import FeedEntry
+from models.store import (
+    SCORES_FNAME,
+    Prefetcher,
+    ScoreStore,
+    WriteBehind,
+    open_store,
+)
 from settings import (
     settings,
     SETTINGS_FILE,
@@ -16,89 +29,161 @@ from settings import (
     db_dir,
 )
 
-import feedparser
+import tracing
+from tracing import span
 from yaspin import yaspin
 
+entry_store = open_store(db_dir, settings.get('store'))
+# Seconds of ratings a crash may lose (0 saves each one before moving on)
+DEFAULT_SAVE_INTERVAL = 2
+# How many posts ahead of the one on screen to get ready in the background
+DEFAULT_PREFETCH = 5
+
 
-def display_loop(unread_items: list[FeedEntry]):
-    for entry in unread_items:
-        print("Would you like to open this one?")
-        print("\tTitle: " + entry.title)
-        print("\tSummary: " + entry.summary)
-        links = entry.links
-        choice = radio_dial([
-            "Not interested",
-            "Show again later",
-        ] + links)
-        if choice == 0:
-            entry.status = "skipped"
-            entry.save()
-            unread_entries.remove(entry)
-            continue
-        if choice == 1:
-            continue
-        while choice > 1:
-            print("  How was it?")
-            link = links.pop(choice - 2)
-            entry.clicked_links.append(link)
-            system_open(link)
+def display_loop(unread_items: list[FeedEntry], writer: WriteBehind, model=None):
+    with Prefetcher(
+            unread_items,
+            entry_store,
+            lookahead=settings.get('prefetch', DEFAULT_PREFETCH),
+            # Models that learn as you read will want each post's text
+            training_text=model is not None and model.learns_while_reading()) as prefetcher:
+        for i, entry in enumerate(unread_items):
+            prefetcher.advance(i)
+            print("Would you like to open this one?")
+            print("\tTitle: " + (entry.title or ""))
+            print("\tSummary: " + (entry.summary or ""))
+            links = list(entry.links)
             choice = radio_dial([
-                "Waste of time",
-                "Worthwhile",
+                "Not interested",
+                "Show again later",
             ] + links)
-        if choice == 0:
-            entry.status = "disliked"
-            entry.save()
-            unread_entries.remove(entry)
-            continue
-        if choice == 1:
-            entry.status = "liked"
-            entry.save()
-            unread_entries.remove(entry)
-            continue
-
-
-def _run_model(unread_items):
+            if choice == 0:
+                entry.status = "skipped"
+                writer.save(entry)
+                # Training counts skipped posts as dislikes, so learn the same here
+                if model:
+                    model.update(entry)
+                continue
+            if choice == 1:
+                continue
+            while choice > 1:
+                print("  How was it?")
+                link = links.pop(choice - 2)
+                entry.clicked_links.append(link)
+                system_open(link)
+                choice = radio_dial([
+                    "Waste of time",
+                    "Worthwhile",
+                ] + links)
+            if choice == 0:
+                entry.status = "disliked"
+                writer.save(entry)
+                if model:
+                    model.update(entry)
+                continue
+            if choice == 1:
+                entry.status = "liked"
+                writer.save(entry)
+                if model:
+                    model.update(entry)
+                continue
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Read your feeds, most interesting posts first.")
+    tracing.add_arguments(parser)
+    return parser.parse_args()
+
+
+def _load_model():
     if settings.get('algo') and settings['algo'] != 'EmptyModel':
-        ModelClass = MODELS.get(settings['algo'])
+        ModelClass = get_model(settings['algo'])
         if not ModelClass:
             print(f"ERROR: Unknown model {settings['algo']}.")
             print("Perhaps you need to update your software?")
-            return unread_items
-        model = ModelClass(**settings.get('algo_params'))
-        (highpri, lowpri) = model.split_and_rank_posts(unread_items)
-        if len(highpri) == 0:
-            print("But none of them are important")
-        else:
-            print(f"{len(highpri)} of them are in your priority inbox:")
-            display_loop(highpri)
-        return lowpri
+            return None
+        return ModelClass(**settings.get('algo_params'))
+    return None
 
 
-if __name__ == '__main__':
-    unread_items: list[FeedEntry] = []
-    with yaspin(text="Loading feed..."):
+def model_key() -> str:
+    """Which model's scores in the ScoreStore are current"""
+    return ScoreStore.key_for(
+        settings.get('algo'), settings.get('algo_params'), db_dir)
+
+
+def _run_model(model, unread_items, writer):
+    scores = ScoreStore(db_dir.joinpath(SCORES_FNAME))
+    try:
+        known_scores = scores.get_many(
+            model_key(), [entry.fbbid for entry in unread_items])
+    finally:
+        scores.close()
+    (highpri, lowpri) = model.split_and_rank_posts(unread_items, known_scores)
+    if len(highpri) == 0:
+        print("But none of them are important")
+    else:
+        print(f"{len(highpri)} of them are in your priority inbox:")
+        display_loop(highpri, writer, model)
+    return lowpri
+
+
+def load_unread() -> list[FeedEntry]:
+    with span('load', posts=len(unread_entries)):
+        ret = []
         for fbbid in unread_entries.items:
             fbbid = fbbid.replace("\n", "")
             if not fbbid:
                 continue
-            unread_items.append(
-                FeedEntry(
-                    json_file=db_dir.joinpath(f"{fbbid}.json")))
-        latest_feed = feedparser.parse(
-            'https://feeds.feedburner.com/Metafilter')
-        for entry in latest_feed.entries:
-            feed_entry = FeedEntry(feed_entry=entry, db_dir=db_dir)
-            if not feed_entry.file_path.exists():
+            ret.append(entry_store.load(fbbid, lazy=True))
+        return ret
+
+
+def fetch_new_entries() -> list[FeedEntry]:
+    """Fetches every feed, saving and queueing the posts we haven't seen"""
+    ret = []
+    latest_feeds = fetch_all(
+        configured_feeds(settings),
+        db_dir.joinpath(FEED_CACHE_DIRNAME))
+    for feed, parsed, cache in latest_feeds:
+        for entry in (parsed.entries if parsed else []):
+            feed_entry = FeedEntry(
+                feed_entry=entry, store=entry_store, feed=feed['namespace'])
+            if feed_entry.fbbid not in entry_store:
                 feed_entry.save()
                 unread_entries.add(feed_entry)
-                unread_items.append(feed_entry)
+                ret.append(feed_entry)
+        # Only now may the next fetch of this feed come back as a 304
+        cache.commit()
+    return ret
+
+
+if __name__ == '__main__':
+    tracing.enable_from_args(parse_args())
+    with yaspin(text="Loading feed..."):
+        unread_items = load_unread()
+        # Leave fetching to refresh.py if it's been set up to run in the background
+        if settings.get('fetch_on_start', True):
+            unread_items += fetch_new_entries()
     print(f"Found {len(unread_items)} unread items!")
-    if len(unread_items) > 0 and SETTINGS_FILE.exists():
-        unread_items = _run_model(unread_items)
-        if len(unread_items) > 0:
-            if not prompt("Continue to read the unimportant posts?"):
-                print("Sounds good! Enjoy your day! :)")
-                quit()
-    display_loop(unread_items)
-    print("That's all for now, folks!")
+    with span('load model', algo=settings.get('algo')):
+        model = _load_model() if SETTINGS_FILE.exists() else None
+    writer = WriteBehind(
+        entry_store,
+        unread_entries,
+        settings.get('save_interval', DEFAULT_SAVE_INTERVAL),
+    )
+    try:
+        if len(unread_items) > 0 and model:
+            unread_items = _run_model(model, unread_items, writer)
+            if len(unread_items) > 0:
+                if not prompt("Continue to read the unimportant posts?"):
+                    print("Sounds good! Enjoy your day! :)")
+                    quit()
+        display_loop(unread_items, writer, model)
+        print("That's all for now, folks!")
+    finally:
+        # Runs on quit() and Ctrl-C too, so no rating is left unsaved
+        writer.close()
+        if model:
+            model.save_state()
@@ -0,0 +1,28 @@
+#!/bin/python3
+
+import yaml
+
+from models.store import (
+    SQLiteStore,
+    SQLITE_FNAME,
+    migrate_json_dir,
+)
+from settings import (
+    settings,
+    SETTINGS_FILE,
+    db_dir,
+)
+from yaspin import yaspin
+
+if __name__ == '__main__':
+    if settings.get('store') == 'sqlite':
+        print("Your posts are already stored in SQLite. Nothing to do!")
+        quit(0)
+    store = SQLiteStore(db_dir.joinpath(SQLITE_FNAME))
+    with yaspin(text="Migrating posts..."):
+        count = migrate_json_dir(db_dir, store)
+    store.close()
+    settings['store'] = 'sqlite'
+    SETTINGS_FILE.write_text(yaml.dump(settings))
+    print(f"Copied {count} posts into {SQLITE_FNAME}.")
+    print("The old .json files were left in place and can be deleted once you're happy.")
@@ -1,13 +1,31 @@
 #!/bin/python3
 
-from .empty import EmptyModel
-from .metadata import TagModel
-from .linear import LinearModel
+from importlib import import_module
 
-ALL_MODELS = [
-    EmptyModel,
-    TagModel,
-    LinearModel,
-]
+# Model class name -> the submodule defining it, in menu order.
+# Models are only imported when first asked for, so that reading with
+# e.g. the TagModel never pays to import numpy and scikit-learn.
+MODEL_MODULES = {
+    'EmptyModel': '.empty',
+    'TagModel': '.metadata',
+    'LinearModel': '.linear',
+    'OnlineModel': '.online',
+}
 
-MODELS = {m.__name__: m for m in ALL_MODELS}
+
+def get_model(name: str):
+    """Imports and returns the model class called name (or None if unknown)"""
+    if name not in MODEL_MODULES:
+        return None
+    return getattr(import_module(MODEL_MODULES[name], __name__), name)
+
+
+def __getattr__(name):
+    # ALL_MODELS and MODELS import every model, so only build them on demand
+    if name == 'ALL_MODELS':
+        return [get_model(m) for m in MODEL_MODULES]
+    if name == 'MODELS':
+        return {m: get_model(m) for m in MODEL_MODULES}
+    if name in MODEL_MODULES:
+        return get_model(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,31 +1,120 @@
 #!/bin/python3
 
+import hashlib
+from array import array
+from collections.abc import Sequence
 from enum import Enum
 from math import sqrt
 
 from .feed import FeedEntry
 
+from tracing import span
+
+
+class CorpusView(Sequence):
+    """A read-only, live list of some of the corpus's entries"""
+
+    def __init__(self, posts: list[FeedEntry], rows: list[int]):
+        self.posts = posts
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.posts[row] for row in self.rows[i]]
+        return self.posts[self.rows[i]]
+
+    def __iter__(self):
+        posts = self.posts
+        return (posts[row] for row in self.rows)
+
 
 class Corpus:
+    """Every post we know about, stored column-wise
+
+    Row i of each column (fbbids, labels, timestamps, posts) describes
+    the i-th post added. The row numbers of each subset models ask for
+    are kept up to date as posts are added, so counting them is O(1)
+    and nothing needs to be recomputed with set arithmetic."""
+
     def __init__(self):
-        self.entries = set()
-        self.liked = set()
-        self.unseen = set()
+        self.posts = []
+        self.fbbids = []
+        self.rows_by_fbbid = {}
+        self.statuses = []
+        # An index into self.statuses for each post
+        self.labels = array('B')
+        self.timestamps = array('q')
+        self.rows_by_status = {}
+        self.rated_rows = []
+        self.disliked_rows = []
+        # 1.0 if liked else 0.0 for each of self.rated, in the same order
+        self.Y = array('d')
 
     def add_entry(self, entry: FeedEntry):
-        self.entries.add(entry)
-        if entry.status == 'liked':
-            self.liked.add(entry)
-        if entry.status == 'unread':
-            self.unseen.add(entry)
+        if entry.fbbid in self.rows_by_fbbid:
+            return
+        row = len(self.posts)
+        self.rows_by_fbbid[entry.fbbid] = row
+        self.posts.append(entry)
+        self.fbbids.append(entry.fbbid)
+        if entry.status not in self.statuses:
+            self.statuses.append(entry.status)
+            self.rows_by_status[entry.status] = []
+        self.labels.append(self.statuses.index(entry.status))
+        self.timestamps.append(entry.timestamp or 0)
+        self.rows_by_status[entry.status].append(row)
+        if entry.status != 'unread':
+            self.rated_rows.append(row)
+            self.Y.append(1.0 if entry.status == 'liked' else 0.0)
+            if entry.status != 'liked':
+                self.disliked_rows.append(row)
+
+    def count(self, status: str) -> int:
+        return len(self.rows_by_status.get(status, ()))
+
+    def with_status(self, status: str) -> CorpusView:
+        return CorpusView(self.posts, self.rows_by_status.setdefault(status, []))
+
+    @property
+    def entries(self):
+        return CorpusView(self.posts, range(len(self.posts)))
+
+    @property
+    def liked(self):
+        return self.with_status('liked')
+
+    @property
+    def unseen(self):
+        return self.with_status('unread')
+
+    @property
+    def rated(self):
+        """Every post that isn't unread, in the order they were added"""
+        return CorpusView(self.posts, self.rated_rows)
 
     @property
     def disliked(self):
-        return self.entries - self.liked - self.unseen
+        """Every rated post that wasn't liked"""
+        return CorpusView(self.posts, self.disliked_rows)
+
+    def rated_chronologically(self) -> CorpusView:
+        return CorpusView(self.posts, sorted(
+            self.rated_rows, key=self.timestamps.__getitem__))
+
+    def fingerprint(self) -> str:
+        """A hash of which posts have been rated, and how"""
+        ret = hashlib.sha256()
+        for fbbid, status in sorted(
+                (self.fbbids[row], self.statuses[self.labels[row]])
+                for row in self.rated_rows):
+            ret.update(f"{fbbid}\t{status}\n".encode('utf-8'))
+        return ret.hexdigest()
 
     def calculate_like_ratio(self):
-        return float(len(self.liked)) / \
-            float(len(self.entries) - len(self.unseen))
+        return float(self.count('liked')) / float(len(self.rated_rows))
 
 
 ModelStatus = Enum('ModelStatus', ['Unanalyzed', 'Analyzed', 'Invalid'])
@@ -60,15 +149,46 @@ class BaseModel:
     def refine(self):
         raise NotImplementedError()
 
-    def split_and_rank_posts(self, posts: list[FeedEntry]):
-        cutoff = self.get_cutoff()
-        highpri = []
-        lowpri = []
-        for post in posts:
-            score = self.score(post)
-            if score >= cutoff:
-                highpri.append((-score, post))
-            else:
-                lowpri.append((-score, post))
-        return ([obj for _, obj in sorted(highpri)],
-                [obj for _, obj in sorted(lowpri)])
+    def update(self, post: FeedEntry):
+        """Called each time the user rates a post while reading
+
+        Override this if your model can learn incrementally."""
+        pass
+
+    def learns_while_reading(self) -> bool:
+        """Whether this model overrides update() (and so wants each rated post's text)"""
+        return type(self).update is not BaseModel.update
+
+    def save_state(self):
+        """Persists anything update() learned. Called at the end of a session."""
+        pass
+
+    def score_many(self, posts: list[FeedEntry]) -> list[float]:
+        """Scores a batch of posts at once
+
+        Override this if your model is faster on batches than one by one"""
+        return [self.score(post) for post in posts]
+
+    def split_and_rank_posts(self, posts: list[FeedEntry], known_scores: dict = None):
+        """Splits posts into (above cutoff, below cutoff), each best first
+
+        known_scores maps fbbids to scores worked out earlier (by refresh.py),
+        so only the posts missing from it need scoring now."""
+        known_scores = known_scores or {}
+        with span('rank', model=self.NAME, posts=len(posts), known=len(known_scores)):
+            cutoff = self.get_cutoff()
+            unscored = [post for post in posts if post.fbbid not in known_scores]
+            new_scores = iter(self.score_many(unscored))
+            scores = [
+                known_scores[post.fbbid] if post.fbbid in known_scores else next(new_scores)
+                for post in posts
+            ]
+            highpri = []
+            lowpri = []
+            for post, score in zip(posts, scores):
+                if score >= cutoff:
+                    highpri.append((-score, post))
+                else:
+                    lowpri.append((-score, post))
+            return ([obj for _, obj in sorted(highpri)],
+                    [obj for _, obj in sorted(lowpri)])
@@ -0,0 +1,85 @@
+#!/bin/python3
+"""Turns out-of-sample scores into a cutoff and an accuracy estimate
+
+Every function here takes one score per rated post (from a model that
+never saw that post's rating) and Y, which is 1.0 for liked posts and
+0.0 for the rest. A post is predicted to be a like if its score is at
+or above the cutoff. "Accuracy" is sqrt(precision × recall)."""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Calibration:
+    cutoff: float
+    precision: float
+    recall: float
+    accuracy: float
+    # How far the misclassified posts' scores fall from the cutoff
+    rmse: float
+
+
+def pr_curve(scores, Y):
+    """The precision and recall of every possible cutoff
+
+    Returns (thresholds, precision, recall), sorted by ascending
+    threshold, where thresholds[i] is the i-th lowest score."""
+    scores = np.asarray(scores, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    # Sort by score, with dislikes before likes among tied scores
+    order = np.lexsort((Y, scores))
+    scores = scores[order]
+    Y = Y[order]
+    likes = Y.sum()
+    # Everything from thresholds[i] up is predicted to be a like
+    likes_below = np.concatenate(([0.0], np.cumsum(Y)[:-1]))
+    recall = 1.0 - likes_below / likes
+    precision = (likes - likes_below) / np.arange(len(Y), 0, -1)
+    return scores, precision, recall
+
+
+def error_spread(scores, Y, cutoff: float) -> float:
+    """The RMS distance past the cutoff of every misclassified post (0 for the rest)"""
+    scores = np.asarray(scores, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    wrong = ((Y == 0.0) & (scores > cutoff)) | ((Y == 1.0) & (scores < cutoff))
+    errors = np.where(wrong, scores - cutoff, 0.0)
+    return float(np.sqrt(np.mean(np.square(errors))))
+
+
+def calibrate(scores, Y) -> Calibration:
+    """Picks the cutoff that maximizes sqrt(precision × recall)"""
+    thresholds, precision, recall = pr_curve(scores, Y)
+    accuracy = np.sqrt(recall * precision)
+    best = int(np.argmax(accuracy))
+    # Split the difference with the next post down, if there is one
+    if best:
+        cutoff = float(round(0.5*(thresholds[best] + thresholds[best-1]), 5))
+    else:
+        cutoff = float(thresholds[0])
+    return Calibration(
+        cutoff=cutoff,
+        precision=float(precision[best]),
+        recall=float(recall[best]),
+        accuracy=float(accuracy[best]),
+        rmse=round(error_spread(scores, Y, cutoff), 5),
+    )
+
+
+def at_cutoff(scores, Y, cutoff: float) -> Calibration:
+    """How well a fixed cutoff does"""
+    scores = np.asarray(scores, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    predicted = scores >= cutoff
+    true_positives = float(Y[predicted].sum())
+    precision = true_positives / max(int(predicted.sum()), 1)
+    recall = true_positives / max(float(Y.sum()), 1.0)
+    return Calibration(
+        cutoff=cutoff,
+        precision=precision,
+        recall=recall,
+        accuracy=float(np.sqrt(precision * recall)),
+        rmse=round(error_spread(scores, Y, cutoff), 5),
+    )
@@ -1,25 +1,101 @@
 #!/bin/python3
 
-from functools import cache
+from collections import OrderedDict
 import feedparser
 from pathlib import Path
 import json
 import re
-from time import mktime
+import threading
+import weakref
+from time import mktime, gmtime
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse, quote
 
 
-def guid_to_fbbid(guid: str) -> str:
-    return guid.replace(":", "=").replace(",", "_")
+def guid_to_fbbid(guid: str, feed: str = None) -> str:
+    ret = guid.replace(":", "=").replace(",", "_")
+    if not feed:
+        return ret
+    # Other feeds' guids are often URLs, so escape anything
+    # that can't go in a filename. Escaped ids never contain a "+"
+    return f"{feed}+{quote(ret, safe='=')}"
+
+
+class SoupLRU:
+    """Bounds how many FeedEntry objects hold on to a parsed summary
+
+    Soups are by far the heaviest derived feature, but everything we
+    actually use them for (links and training text) is cached separately
+    on the entry, so we can afford to throw old ones away."""
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize
+        self.refs = OrderedDict()
+        # Reentrant, because the weakref callbacks can fire mid-touch
+        self.lock = threading.RLock()
+
+    def touch(self, entry):
+        key = id(entry)
+        with self.lock:
+            if key in self.refs:
+                self.refs.move_to_end(key)
+                return
+            if self.maxsize is None:
+                return
+            self.refs[key] = weakref.ref(
+                entry, lambda _, key=key: self._forget(key))
+            while len(self.refs) > self.maxsize:
+                _, ref = self.refs.popitem(last=False)
+                evicted = ref()
+                if evicted is not None:
+                    evicted._soup = None
+
+    def _forget(self, key):
+        with self.lock:
+            self.refs.pop(key, None)
+
+
+soup_cache = SoupLRU(maxsize=256)
 
 
 class FeedEntry:
+    # A corpus holds tens of thousands of these, so skip the per-instance dict
+    __slots__ = (
+        'store',
+        'file_path',
+        'feed',
+        'title',
+        '_summary',
+        'author',
+        'link',
+        'guid',
+        'timestamp',
+        'tags',
+        'status',
+        'clicked_links',
+        # Derived features, computed on first use and freed with the entry
+        '_soup',
+        '_links',
+        '_parsable_links',
+        '_training_text',
+        '__weakref__',
+    )
+
     def __init__(self, feed_entry: feedparser.FeedParserDict = None,
-                 json_file: Path = None, db_dir: Path = None):
+                 json_file: Path = None, db_dir: Path = None,
+                 data: dict = None, store=None, feed: str = None):
+        # The EntryStore (if any) that save() should write back to
+        self.store = store
+        self.file_path = None
+        # A summary of None is fetched from the store on first access
+        self._summary = None
+        self._clear_derived()
         if json_file:
             self.file_path = json_file
             data = json.loads(json_file.read_text())
+        if data:
+            # The name of the feed this came from (None for MetaFilter)
+            self.feed = data.get('feed')
             self.title = data.get('title')
             self.summary = data.get('summary')
             self.author = data.get('author')
@@ -30,17 +106,22 @@ class FeedEntry:
             self.status = data.get('status')
             self.clicked_links = data.get('clicked_links') or []
         if feed_entry:
-            if not db_dir:
+            if not (db_dir or store):
                 raise RuntimeError(
-                    "FeedEntry needs either a json_file or db_dir Path")
-            self.title = feed_entry.get('title')
-            self.summary = feed_entry.get('summary')
+                    "FeedEntry needs either a json_file, db_dir Path or store")
+            self.feed = feed
+            # Not every feed gives its items a title or a description
+            self.title = feed_entry.get('title') or ''
+            self.summary = feed_entry.get('summary') or ''
             self.author = feed_entry.get('author')
             self.link = feed_entry.get('link')
-            self.guid = feed_entry.get('guid')
-            self.file_path = db_dir.joinpath(f"{self.fbbid}.json")
-            self.timestamp = int(mktime(feed_entry.published_parsed))
-            self.tags = [tag.term for tag in feed_entry.get('tags')]
+            self.guid = feed_entry.get('guid') or self.link
+            if db_dir:
+                self.file_path = db_dir.joinpath(f"{self.fbbid}.json")
+            published = feed_entry.get('published_parsed') or \
+                feed_entry.get('updated_parsed') or gmtime()
+            self.timestamp = int(mktime(published))
+            self.tags = [tag.term for tag in feed_entry.get('tags') or []]
             self.status = "unread"
             self.clicked_links = []
 
@@ -51,22 +132,80 @@ class FeedEntry:
     def __gt__(self, other):
         return self.timestamp > other.timestamp
 
+    # The same post loaded twice is still the same post
+    def __eq__(self, other):
+        if not isinstance(other, FeedEntry):
+            return NotImplemented
+        return self.fbbid == other.fbbid
+
+    def __hash__(self):
+        return hash(self.fbbid)
+
+    # Parse trees are large and cheap to rebuild, so leave them out of pickles
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__
+                if slot not in ('_soup', '__weakref__')}
+
+    def __setstate__(self, state):
+        self._soup = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    def _clear_derived(self):
+        self._soup = None
+        self._links = None
+        self._parsable_links = None
+        self._training_text = None
+
     @property
     def fbbid(self):
-        return guid_to_fbbid(self.guid)
+        return guid_to_fbbid(self.guid, self.feed)
+
+    @property
+    def summary(self):
+        if self._summary is None and self.store:
+            self._summary = self.store.load_summary(self.fbbid)
+        return self._summary
+
+    @summary.setter
+    def summary(self, value):
+        if value != self._summary:
+            self._clear_derived()
+        self._summary = value
 
     @property
-    @cache
     def soup(self):
-        return BeautifulSoup(self.summary, 'html.parser')
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.summary or '', 'html.parser')
+        soup_cache.touch(self)
+        return self._soup
 
     @property
-    @cache
     def links(self):
-        return [a['href'] for a in self.soup.find_all('a', href=True)]
-    
-    @cache
+        if self._links is None:
+            # Other feeds' links may be relative, or not web links at all
+            urls = [urljoin(self.link or '', a['href'])
+                    for a in self.soup.find_all('a', href=True)]
+            self._links = [url for url in urls if urlparse(url).hostname]
+        return self._links
+
+    def prefetch(self, store=None, training_text: bool = False):
+        """Computes everything display needs ahead of time
+
+        Pass a store to load a lazy summary through, if this entry's own
+        store can't be used from the calling thread."""
+        if self._summary is None and store:
+            self._summary = store.load_summary(self.fbbid)
+        self.links
+        if training_text:
+            self.get_text_for_training()
+
     def parsable_links(self):
+        if self._parsable_links is None:
+            self._parsable_links = self._calculate_parsable_links()
+        return self._parsable_links
+
+    def _calculate_parsable_links(self):
         ret = []
         for url in self.links:
             parse = urlparse(url)
@@ -86,15 +225,22 @@ class FeedEntry:
 
     def domains_for_rating(self):
         links = self.links_for_rating()
-        return list(
-            {'.'.join(urlparse(url).hostname.split('.')[-2:]) for url in links})
+        hosts = (urlparse(url).hostname for url in links)
+        return list({'.'.join(host.split('.')[-2:]) for host in hosts if host})
 
     def save(self):
-        self.file_path.write_text(self.json())
+        if self.store:
+            self.store.save(self)
+        else:
+            self.file_path.write_text(self.json())
     
-    @cache
     def get_text_for_training(self):
         """A single string representing the post in a matter suitable for a Bag-of-Words model"""
+        if self._training_text is None:
+            self._training_text = self._calculate_text_for_training()
+        return self._training_text
+
+    def _calculate_text_for_training(self):
         ret = []
         TITLE_WEIGHT = 2
         SUMMARY_WEIGHT = 1
@@ -111,14 +257,18 @@ class FeedEntry:
         return ' '.join(ret)
 
     def json(self) -> str:
-        return json.dumps({
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def to_dict(self) -> dict:
+        return {
             'title': self.title,
             'summary': self.summary,
             'author': self.author,
             'link': self.link,
             'guid': self.guid,
+            'feed': self.feed,
             'timestamp': self.timestamp,
             'tags': self.tags,
             'status': self.status,
             'clicked_links': self.clicked_links,
-        }, sort_keys=True)
+        }
@@ -1,33 +1,85 @@
 #!/bin/python3
 
+import hashlib
+import json
+from math import log10
+import multiprocessing
+import os
 import time
 import numpy as np
-import joblib
-from math import log10
+from functools import partial
+from itertools import product
+from multiprocessing.pool import ThreadPool
 from random import gauss
-from scipy.sparse import find as destructure
-from nltk.tokenize import NLTKWordTokenizer
-from nltk.stem.snowball import SnowballStemmer
-from sklearn.feature_extraction.text import (
-    TfidfVectorizer,
-    TfidfTransformer,
-    CountVectorizer,
-)
-from sklearn.feature_selection import chi2
-from sklearn.linear_model import RidgeClassifierCV
+import yaml
 from yaspin import yaspin
 
 from .base import BaseModel, Corpus, ModelStatus
 from .feed import FeedEntry
+from .evaluation import at_cutoff, calibrate
+from .weights import LinearWeights
+from .text import (
+    TOKENIZER_VERSION,
+    pretokenized,
+    tokenize_corpus,
+    # Older pickled vectorizers refer to models.linear.stemmed_nltk_tokenizer
+    stemmed_nltk_tokenizer,
+)
+
+from settings import db_dir, settings, SETTINGS_FILE
+from tracing import span
+
+# scikit-learn and joblib are only imported to train (or to convert old
+# pickles), so scoring with saved weights needs nothing but numpy and nltk
+
+
+def _store_cv_param(RidgeClassifierCV) -> str:
+    # scikit-learn 1.5 renamed store_cv_values to store_cv_results
+    return 'store_cv_results' \
+        if 'store_cv_results' in RidgeClassifierCV().get_params() \
+        else 'store_cv_values'
 
-from settings import db_dir
 
-stemmer = SnowballStemmer('english')
-tokenizer = NLTKWordTokenizer()
-def stemmed_nltk_tokenizer(s):
-    tokens = tokenizer.tokenize(s)
-    tokens = [t[:-1] if t.endswith('.') else t for t in tokens]
-    return [stemmer.stem(token) for token in tokens]
+# Set by _init_search in each of the search's workers
+_search_features = None
+
+
+def _init_search(word_counts, docs_with_term, term_chi2, Y):
+    global _search_features
+    _search_features = (word_counts, docs_with_term, term_chi2, Y)
+
+
+def _evaluate_candidate(candidate: tuple, alphas: tuple):
+    """Fits one dictionary's ridge models and calibrates each alpha's leave-one-out scores"""
+    min_docs_with_term, min_chi2 = candidate
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.linear_model import RidgeClassifierCV
+    word_counts, docs_with_term, term_chi2, Y = _search_features
+    selected = (docs_with_term >= min_docs_with_term) & (term_chi2 > min_chi2)
+    if not selected.any():
+        return None
+    X = TfidfTransformer().fit_transform(word_counts[:, selected])
+    # With a scoring function set, the stored cv values are predictions (not errors)
+    model = RidgeClassifierCV(
+        scoring="balanced_accuracy",
+        alphas=list(alphas),
+        **{_store_cv_param(RidgeClassifierCV): True},
+    )
+    model.fit(X, Y)
+    Y_p = getattr(model, 'cv_results_', None)
+    if Y_p is None:
+        Y_p = model.cv_values_
+    accuracy, alpha = max(
+        (calibrate(Y_p[:, 0, i], Y).accuracy, alpha)
+        for i, alpha in enumerate(alphas))
+    return {
+        'min_docs_with_term': min_docs_with_term,
+        'min_chi2': min_chi2,
+        'alpha': alpha,
+        'accuracy': accuracy,
+        'terms': int(selected.sum()),
+    }
+
 
 class LinearModel(BaseModel):
     NAME = "Linear Regressor"
@@ -35,6 +87,19 @@ class LinearModel(BaseModel):
     MIN_DATA = "25 likes and dislikes"
     MIN_DOCS_WITH_TERM = 2
     MIN_CHI2 = 0.02
+    ALPHAS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1)
+    CACHE_DIRNAME = 'linear-cache'
+    WEIGHTS_DIRNAME = 'linear-weights'
+    # Seconds to spend searching for better hyperparameters (0 = don't)
+    SEARCH_BUDGET = 0
+    SEARCH_WORKERS = None
+    SEARCH_MIN_DOCS = (1, 2, 3, 5, 8)
+    SEARCH_MIN_CHI2 = (0.0, 0.005, 0.01, 0.02, 0.05, 0.1)
+    SEARCH_ALPHAS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10)
+    # Stop once this many candidates in a row fail to beat the best so far
+    SEARCH_PATIENCE = 8
+    # Every n-th rated post is kept out of the search to estimate the winner's accuracy
+    SEARCH_HOLDOUT = 5
 
     def __init__(self, corpus: Corpus = None, **kwargs):
         super().__init__(corpus=corpus, **kwargs)
@@ -42,98 +107,277 @@ class LinearModel(BaseModel):
             if len(corpus.liked) < 25 or len(corpus.disliked) < 25:
                 self.status = ModelStatus.Invalid
         self.cutoff = kwargs.get('cutoff')
-        if kwargs.get('model_file'):
-            self.model = joblib.load(db_dir.joinpath(kwargs['model_file']))
-            self.vectorizer = joblib.load(db_dir.joinpath(kwargs['vectorizer_file']))
-            self.rmse = kwargs.get('rmse', 0)
+        self.rmse = kwargs.get('rmse', 0)
+        # The rows search() didn't look at, if it ran
+        self.holdout = None
+        if kwargs.get('weights_dir'):
+            self.weights = LinearWeights.load(db_dir.joinpath(kwargs['weights_dir']))
+        elif kwargs.get('model_file'):
+            # Settings saved before the weights format existed
+            import joblib
+            model = joblib.load(db_dir.joinpath(kwargs['model_file']))
+            vectorizer = joblib.load(db_dir.joinpath(kwargs['vectorizer_file']))
+            self.weights = LinearWeights.from_sklearn(vectorizer, model)
+            self._upgrade_settings(kwargs)
+
+    def _upgrade_settings(self, old_params: dict):
+        """Saves the converted weights and points settings.yaml at them
+
+        so the old pickles (and sklearn) are only ever loaded once."""
+        if settings.get('algo') != self.__class__.__name__ \
+                or settings.get('algo_params') != old_params:
+            return
+        params = {k: v for k, v in old_params.items()
+                  if k not in ('model_file', 'vectorizer_file')}
+        params.update(self.get_parameters())
+        settings['algo_params'] = params
+        SETTINGS_FILE.write_text(yaml.dump(settings))
 
     def get_cutoff(self):
         return self.cutoff
 
+    def hyperparameters(self) -> dict:
+        ret = {
+            'min_docs_with_term': self.MIN_DOCS_WITH_TERM,
+            'min_chi2': self.MIN_CHI2,
+            'alphas': list(self.ALPHAS),
+            'tokenizer_version': TOKENIZER_VERSION,
+        }
+        if self.SEARCH_BUDGET:
+            ret['search_budget'] = self.SEARCH_BUDGET
+        return ret
+
+    def fingerprint(self) -> str:
+        """Identifies the training run: what was rated and how we trained on it"""
+        return hashlib.sha256(json.dumps(
+            [self.corpus.fingerprint(), self.hyperparameters()],
+            sort_keys=True,
+        ).encode('utf-8')).hexdigest()
+
+    def _load_cached(self, fingerprint: str) -> bool:
+        cache_dir = db_dir.joinpath(self.CACHE_DIRNAME)
+        stats_file = cache_dir.joinpath('stats.json')
+        if not (stats_file.exists() and cache_dir.joinpath('meta.json').exists()):
+            return False
+        stats = json.loads(stats_file.read_text())
+        if stats.get('fingerprint') != fingerprint:
+            return False
+        self.weights = LinearWeights.load(cache_dir, mmap=False)
+        self.cutoff = stats['cutoff']
+        self.precision = stats['precision']
+        self.recall = stats['recall']
+        self.accuracy = stats['accuracy']
+        self.rmse = stats['rmse']
+        return True
+
+    def _save_cache(self, fingerprint: str):
+        cache_dir = db_dir.joinpath(self.CACHE_DIRNAME)
+        self.weights.save(cache_dir)
+        # Written last, so a half-written cache never matches
+        cache_dir.joinpath('stats.json').write_text(json.dumps({
+            'fingerprint': fingerprint,
+            'cutoff': self.cutoff,
+            'precision': float(self.precision),
+            'recall': float(self.recall),
+            'accuracy': float(self.accuracy),
+            'rmse': self.rmse,
+        }))
+
     def analyze(self):
-        corpus = [entry for entry in self.corpus.entries - self.corpus.unseen]
-        Y = [1.0 if entry.status == "liked" else 0.0 for entry in corpus]
-        with yaspin(text="Compiling dictionary..."):
-            dictionary = self.create_dictionary(corpus, Y)
+        from sklearn.feature_extraction.text import (
+            TfidfVectorizer,
+            TfidfTransformer,
+        )
+        from sklearn.linear_model import RidgeClassifierCV
+        fingerprint = self.fingerprint()
+        if self._load_cached(fingerprint):
+            print("No posts have been rated since the last analysis, so reusing that model.")
+            print(f"Cross-validation predicted an accuracy of P={self.precision*100:.0f}% × R={self.recall*100:.0f}% = {self.accuracy*100:.1f}% at cutoff={self.cutoff}±{self.rmse}\n")
+            self.status = ModelStatus.Analyzed
+            return
+        corpus = self.corpus.rated
+        Y = np.array(self.corpus.Y)
+        documents = tokenize_corpus(corpus, db_dir)
+        with yaspin(text="Compiling dictionary..."), span('dictionary'):
+            term_stats = self.term_stats(documents, Y)
+        if self.SEARCH_BUDGET:
+            with span('search', budget=self.SEARCH_BUDGET):
+                term_stats = self.search(term_stats, Y)
+        dictionary, word_counts = self.select_terms(*term_stats)
+        print(f"Compiled a dictionary with {len(dictionary)} terms")
+        with yaspin(text="Extracting features..."), span('features'):
+            # Reweight the dictionary's own counts rather than counting again
+            tfidf = TfidfTransformer()
+            X = tfidf.fit_transform(word_counts)
+        # The vectorizer we keep for scoring has to tokenize raw text itself
         self.vectorizer = TfidfVectorizer(
             tokenizer=stemmed_nltk_tokenizer,
             lowercase=False,
             token_pattern=None,
             vocabulary=dictionary,
         )
-        print(f"Compiled a dictionary with {len(dictionary)} terms")
-        with yaspin(text="Extracting features..."):
-            X = self.vectorizer.fit_transform((
-                entry.get_text_for_training() for entry in corpus
-            ))
+        self.vectorizer.idf_ = tfidf.idf_
         started_at = time.time()
         self.model = RidgeClassifierCV(
-            store_cv_values=True,
             scoring="balanced_accuracy",
-            alphas=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1),
+            alphas=list(self.ALPHAS),
+            **{_store_cv_param(RidgeClassifierCV): True},
         )
-        with yaspin(text="Fitting a model..."):
+        with yaspin(text="Fitting a model..."), span('fit', samples=X.shape[0], features=X.shape[1]):
             self.model.fit(X, Y)
-        alpha = round(log10(self.model.alpha_)) + 5
-        print(f"Done fitting in {time.time() - started_at:.3f} seconds.\nSelected smoothing level {alpha} (α={self.model.alpha_})")
-        # Use the model's provided Cross Validation data to select the optimal cutoff
-        # and to accurately estimate the model's accuracy because the default
-        # cutoff of 0 is not always ideal and because model.best_score_ is overfit
-        Y_p = self.model.cv_values_
-        true_positives = [(Y_p[i][0][alpha], Y[i]) for i in range(len(Y))]
-        true_positives.sort()
-        true_positives = np.array(true_positives)
-        positive_cumsum = np.cumsum(true_positives[:, 1])
-        # roll the cumsum forward by one because the cutoff will include that item
-        positive_cumsum = np.roll(positive_cumsum, 1)
-        positive_cumsum[0] = 0
-        recall = 1.0 - (positive_cumsum / len(self.corpus.liked))
-        precision = (len(self.corpus.liked) - positive_cumsum) / np.arange(len(Y), 0, -1)
-        accuracy = np.sqrt(recall * precision)
-        max_accuracy_i = np.argmax(accuracy)
-        self.cutoff = float(round(0.5*(true_positives[max_accuracy_i][0]+true_positives[max_accuracy_i-1][0]), 5))
-        self.accuracy = accuracy[max_accuracy_i]
-        self.precision = precision[max_accuracy_i]
-        self.recall = recall[max_accuracy_i]
-        final_errors = [
-            (Y_p[i,0,alpha] - self.cutoff)
-            if (Y[i]==0.0 and Y_p[i,0,alpha]>self.cutoff) or (Y[i]==1.0 and Y_p[i,0,alpha]<self.cutoff)
-            else 0
-            for i in range(len(Y))
-        ]
-        self.rmse = round(float(np.sqrt(np.mean(np.square(final_errors)))), 5)
+        # Which of ALPHAS (and so which column of the CV scores) was picked
+        alpha = list(self.ALPHAS).index(self.model.alpha_)
+        level = round(log10(self.model.alpha_)) + 5
+        print(f"Done fitting in {time.time() - started_at:.3f} seconds.\nSelected smoothing level {level} (α={self.model.alpha_})")
+        with span('calibration'):
+            # Use the model's provided Cross Validation data to select the optimal cutoff
+            # and to accurately estimate the model's accuracy because the default
+            # cutoff of 0 is not always ideal and because model.best_score_ is overfit
+            Y_p = getattr(self.model, 'cv_results_', None)
+            if Y_p is None:
+                Y_p = self.model.cv_values_
+            if self.holdout is None:
+                calibration = calibrate(Y_p[:, 0, alpha], Y)
+            else:
+                # The search scores were the best of many tries, so overstate
+                # the accuracy. Pick the cutoff without the held out posts
+                # too, so their scores give an unbiased estimate.
+                searched = ~self.holdout
+                calibration = calibrate(Y_p[searched, 0, alpha], Y[searched])
+                held_out = at_cutoff(
+                    Y_p[self.holdout, 0, alpha], Y[self.holdout], calibration.cutoff)
+                calibration.precision = held_out.precision
+                calibration.recall = held_out.recall
+                calibration.accuracy = held_out.accuracy
+        self.cutoff = calibration.cutoff
+        self.precision = calibration.precision
+        self.recall = calibration.recall
+        self.accuracy = calibration.accuracy
+        self.rmse = calibration.rmse
+        if self.holdout is not None:
+            print(f"On the {int(self.holdout.sum())} posts the search held out:")
         print(f"Cross-validation predicts an accuracy of P={self.precision*100:.0f}% × R={self.recall*100:.0f}% = {self.accuracy*100:.1f}% at cutoff={self.cutoff}±{self.rmse}\n")
+        self.weights = LinearWeights.from_sklearn(self.vectorizer, self.model)
         self.status = ModelStatus.Analyzed
+        self._save_cache(fingerprint)
 
     def score(self, post: FeedEntry):
-        x = self.vectorizer.transform([post.get_text_for_training(), ])
-        y_p = self.model.decision_function(x)
+        return self.score_many([post])[0]
+
+    def score_many(self, posts: list[FeedEntry]):
+        if not posts:
+            return []
+        y_p = self.weights.decision_function([
+            post.get_text_for_training() for post in posts
+        ])
         if not self.rmse:
-            return float(y_p[0])
-        return float(y_p[0]) + gauss(sigma=self.rmse)
+            return [float(y) for y in y_p]
+        return [float(y) + gauss(sigma=self.rmse) for y in y_p]
 
     def get_parameters(self):
         ret = super().get_parameters()
         ret['cutoff'] = self.cutoff
-        VECTORIZER_FNAME = 'linear-vectorizer.pkl'
-        MODEL_FNAME = 'linear-model.pkl'
-        joblib.dump(self.vectorizer, db_dir.joinpath(VECTORIZER_FNAME), compress=True)
-        joblib.dump(self.model, db_dir.joinpath(MODEL_FNAME), compress=True)
-        ret['model_file'] = MODEL_FNAME
-        ret['vectorizer_file'] = VECTORIZER_FNAME
+        self.weights.save(db_dir.joinpath(self.WEIGHTS_DIRNAME))
+        ret['weights_dir'] = self.WEIGHTS_DIRNAME
         ret['rmse'] = self.rmse
         return ret
 
-    def create_dictionary(self, corpus: list, Y: list):
-        word_counter = CountVectorizer(tokenizer=stemmed_nltk_tokenizer, lowercase=False, token_pattern=None)
-        word_counts = word_counter.fit_transform((
-            entry.get_text_for_training() for entry in corpus
-        ))
-        _, docs_with_term, _ = destructure(word_counts)
-        has_min_docs = np.bincount(docs_with_term) >= self.MIN_DOCS_WITH_TERM
-        trans = TfidfTransformer()
-        X = trans.fit_transform(word_counts)
-        cs, _ = chi2(X, Y)
-        reasonable_chi2 = cs > self.MIN_CHI2
-        return word_counter.get_feature_names_out()[has_min_docs & reasonable_chi2]
+    def create_dictionary(self, documents: list[list[str]], Y: list):
+        """Selects the terms worth keeping
+
+        Returns the selected terms and the (CSR) count matrix of just those
+        columns, so the caller never has to count the corpus a second time."""
+        return self.select_terms(*self.term_stats(documents, Y))
+
+    def term_stats(self, documents: list[list[str]], Y: list):
+        """Counts every term once, for any number of select_terms calls
+
+        Returns (terms, CSR count matrix, docs with each term, each term's chi²)"""
+        from sklearn.feature_extraction.text import CountVectorizer
+        word_counter = CountVectorizer(analyzer=pretokenized)
+        word_counts = word_counter.fit_transform(documents)
+        # A CSR matrix's column indices list each term once per document it's in
+        docs_with_term = np.bincount(word_counts.indices, minlength=word_counts.shape[1])
+        return (word_counter.get_feature_names_out(), word_counts,
+                docs_with_term, self.term_chi2(word_counts, Y))
+
+    @staticmethod
+    def term_chi2(word_counts, Y) -> np.ndarray:
+        """How strongly each term's tf-idf weight depends on the rating"""
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from sklearn.feature_selection import chi2
+        cs, _ = chi2(TfidfTransformer().fit_transform(word_counts), Y)
+        return np.nan_to_num(cs)
+
+    def select_terms(self, terms, word_counts, docs_with_term, term_chi2):
+        has_min_docs = docs_with_term >= self.MIN_DOCS_WITH_TERM
+        reasonable_chi2 = term_chi2 > self.MIN_CHI2
+        selected = has_min_docs & reasonable_chi2
+        return terms[selected], word_counts[:, selected]
+
+    def search(self, term_stats, Y):
+        """Tries other dictionary cutoffs and alphas for up to SEARCH_BUDGET seconds
 
+        Every candidate reuses the same term counts. The best one found
+        replaces MIN_DOCS_WITH_TERM, MIN_CHI2 and ALPHAS on this model.
+        Returns term_stats with χ² recomputed without the held out posts."""
+        original_stats = term_stats
+        terms, word_counts, docs_with_term, term_chi2 = term_stats
+        # Start from the defaults and work outwards
+        default_docs = min(self.SEARCH_MIN_DOCS, key=lambda d: abs(d - self.MIN_DOCS_WITH_TERM))
+        default_chi2 = min(self.SEARCH_MIN_CHI2, key=lambda c: abs(c - self.MIN_CHI2))
+        candidates = sorted(
+            product(self.SEARCH_MIN_DOCS, self.SEARCH_MIN_CHI2),
+            key=lambda c: abs(self.SEARCH_MIN_DOCS.index(c[0]) - self.SEARCH_MIN_DOCS.index(default_docs)) +
+                abs(self.SEARCH_MIN_CHI2.index(c[1]) - self.SEARCH_MIN_CHI2.index(default_chi2)))
+        # Only the search rows' labels are used to pick a candidate, so the
+        # held out rows can still give an honest estimate of the winner
+        self.holdout = np.arange(len(Y)) % self.SEARCH_HOLDOUT == 0
+        searched = ~self.holdout
+        # The dictionary mustn't be chosen with their labels either
+        term_chi2 = self.term_chi2(word_counts[searched], Y[searched])
+        term_stats = (terms, word_counts, docs_with_term, term_chi2)
+        # Background analysis already runs us in a (daemonic) pool
+        # worker, and those aren't allowed child processes
+        Pool = ThreadPool if multiprocessing.current_process().daemon \
+            else multiprocessing.Pool
+        pool = Pool(
+            self.SEARCH_WORKERS or os.cpu_count(),
+            initializer=_init_search,
+            initargs=(word_counts[searched], docs_with_term, term_chi2, Y[searched]))
+        deadline = time.time() + self.SEARCH_BUDGET
+        best = None
+        tried = 0
+        since_best = 0
+        with yaspin(text="Searching hyperparameters...") as spinner:
+            results = pool.imap_unordered(
+                partial(_evaluate_candidate, alphas=self.SEARCH_ALPHAS), candidates)
+            try:
+                while tried < len(candidates):
+                    result = results.next(timeout=max(0, deadline - time.time()))
+                    tried += 1
+                    if result and (best is None or result['accuracy'] > best['accuracy']):
+                        best = result
+                        since_best = 0
+                    else:
+                        since_best += 1
+                    spinner.text = f"Searching hyperparameters... ({tried}/{len(candidates)}, best {best['accuracy']*100:.1f}%)" \
+                        if best else f"Searching hyperparameters... ({tried}/{len(candidates)})"
+                    if since_best >= self.SEARCH_PATIENCE:
+                        break
+            except multiprocessing.TimeoutError:
+                pass
+            finally:
+                # Kills any candidates still being fitted, so they don't
+                # slow down the final fit (threads finish their current one)
+                pool.terminate()
+        if best is None:
+            self.holdout = None
+            print(f"The search didn't finish any candidates in {self.SEARCH_BUDGET} seconds. Using the defaults.")
+            return original_stats
+        stopped = "stopped early" if tried < len(candidates) else "tried them all"
+        print(f"Searched {tried}/{len(candidates)} candidates ({stopped}). Best: {best['terms']} terms in >={best['min_docs_with_term']} posts with χ²>{best['min_chi2']}, α={best['alpha']} (search score {best['accuracy']*100:.1f}%)")
+        self.MIN_DOCS_WITH_TERM = best['min_docs_with_term']
+        self.MIN_CHI2 = best['min_chi2']
+        self.ALPHAS = (best['alpha'],)
+        return term_stats
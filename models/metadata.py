@@ -1,6 +1,7 @@
 #!/bin/python3
 
 from collections import defaultdict
+from math import sqrt
 
 from .feed import FeedEntry
 from .base import Corpus
@@ -9,31 +10,59 @@ from utils import checklist_prompt
 from .base import BaseModel, ModelStatus
 
 
+def to_bitset(indexes) -> int:
+    """An int with bit i set for each i in indexes"""
+    indexes = list(indexes)
+    if not indexes:
+        return 0
+    bits = bytearray(max(indexes) // 8 + 1)
+    for i in indexes:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
 class TagCloud:
-    def __init__(self):
-        self.likes = defaultdict(set)
-        self.entries = defaultdict(set)
+    """Which of the rated posts have each tag, as bitsets over the posts
+
+    Post i is bit i, so the posts with any of several tags are just the
+    OR of their bitsets, and counting them is a popcount."""
+
+    def __init__(self, post_tags: list[list[str]], liked: list[bool]):
+        self.liked = to_bitset(i for i, like in enumerate(liked) if like)
+        self.indexes = defaultdict(list)
+        self.like_counts = defaultdict(int)
+        for i, tags in enumerate(post_tags):
+            for tag in tags:
+                self.indexes[tag].append(i)
+                if liked[i]:
+                    self.like_counts[tag] += 1
+        # Only built for the tags someone asks about (usually just the tops)
+        self.bitsets = {}
+        self.tops = []
+
+    def bitset(self, tag) -> int:
+        ret = self.bitsets.get(tag)
+        if ret is None:
+            ret = self.bitsets[tag] = to_bitset(self.indexes.get(tag, ()))
+        return ret
 
-    def add_like(self, tag, entry):
-        self.entries[tag].add(entry)
-        self.likes[tag].add(entry)
+    def count(self, tag) -> int:
+        return len(self.indexes.get(tag, ()))
 
-    def add_dislike(self, tag, entry):
-        self.entries[tag].add(entry)
+    def likes(self, tag) -> int:
+        return self.like_counts.get(tag, 0)
 
     def top(self, N=30, min_likes=2, min_ratio=0.2):
-        ret = list(self.likes.keys())
-        ret = [k for k in ret if len(self.likes[k]) >= min_likes and (
-            len(self.likes[k]) / len(self.entries[k])) >= min_ratio]
-        ret.sort(key=lambda k: len(self.likes[k]) / len(self.entries[k]),
-                 reverse=True)
+        ret = [k for k in self.indexes if self.likes(k) >= min_likes and (
+            self.likes(k) / self.count(k)) >= min_ratio]
+        ret.sort(key=lambda k: self.likes(k) / self.count(k), reverse=True)
         self.tops = ret[:N]
         return self.tops
 
-    def posts_with(self, tags):
-        ret = set()
+    def posts_with(self, tags) -> int:
+        ret = 0
         for t in tags:
-            ret.update(self.entries[t])
+            ret |= self.bitset(t)
         return ret
 
 
@@ -41,6 +70,7 @@ class TagModel(BaseModel):
     NAME = "Favorite Tags/Domains"
     DESCRIPTION = "Marks only posts containing favorited tags or link domains as \"important\""
     MIN_DATA = "one tag or domain with two likes"
+    FOLDS = 5
 
     def __init__(self, corpus: Corpus = None, **kwargs):
         super().__init__(corpus=corpus, **kwargs)
@@ -61,19 +91,12 @@ class TagModel(BaseModel):
         return ret
 
     def analyze(self):
-        self.tags_cloud = TagCloud()
-        self.domains_cloud = TagCloud()
-        for entry in (self.corpus.entries - self.corpus.unseen):
-            for tag in entry.tags:
-                if entry.status == "liked":
-                    self.tags_cloud.add_like(tag, entry)
-                else:
-                    self.tags_cloud.add_dislike(tag, entry)
-            for domain in entry.domains_for_rating():
-                if entry.status == "liked":
-                    self.domains_cloud.add_like(domain, entry)
-                else:
-                    self.domains_cloud.add_dislike(domain, entry)
+        rated = self.corpus.rated
+        liked = [y == 1.0 for y in self.corpus.Y]
+        post_tags = [entry.tags for entry in rated]
+        post_domains = [entry.domains_for_rating() for entry in rated]
+        self.tags_cloud = TagCloud(post_tags, liked)
+        self.domains_cloud = TagCloud(post_domains, liked)
         ratio = self.corpus.calculate_like_ratio()
         top_tags = self.tags_cloud.top(min_ratio=ratio)
         top_domains = self.domains_cloud.top(min_ratio=ratio)
@@ -86,19 +109,50 @@ class TagModel(BaseModel):
         for i in range(r):
             tag = top_tags[i]
             print(
-                f"{i+1}. {tag} ({len(self.tags_cloud.likes[tag])}/{len(self.tags_cloud.entries[tag])}={100.0*len(self.tags_cloud.likes[tag])/len(self.tags_cloud.entries[tag]):.1f}%)")
+                f"{i+1}. {tag} ({self.tags_cloud.likes(tag)}/{self.tags_cloud.count(tag)}={100.0*self.tags_cloud.likes(tag)/self.tags_cloud.count(tag):.1f}%)")
         s = len(top_domains)
         if s > 0:
             print(f"\nYour {s} top-liked domains are:")
             for i in range(s):
                 domain = top_domains[i]
                 print(
-                    f"{i+1}. {domain} ({len(self.domains_cloud.likes[domain])}/{len(self.domains_cloud.entries[domain])}={len(self.domains_cloud.likes[domain])*100.0/len(self.domains_cloud.entries[domain]):.1f}%)")
+                    f"{i+1}. {domain} ({self.domains_cloud.likes(domain)}/{self.domains_cloud.count(domain)}={self.domains_cloud.likes(domain)*100.0/self.domains_cloud.count(domain):.1f}%)")
         self.tags = top_tags
         self.domains = top_domains
         self.status = ModelStatus.Analyzed
+        self._make_folds(post_tags, post_domains, liked)
         self._calculate_stats()
 
+    def _make_folds(self, post_tags, post_domains, liked):
+        """Each fold's posts (as a bitset) with the tops picked from the other folds"""
+        self.folds = []
+        for fold in range(self.FOLDS):
+            train = [i for i in range(len(liked)) if i % self.FOLDS != fold]
+            train_liked = [liked[i] for i in train]
+            ratio = sum(train_liked) / len(train)
+            self.folds.append((
+                to_bitset(range(fold, len(liked), self.FOLDS)),
+                set(TagCloud([post_tags[i] for i in train], train_liked).top(min_ratio=ratio)),
+                set(TagCloud([post_domains[i] for i in train], train_liked).top(min_ratio=ratio)),
+            ))
+
+    def _cv_stats(self, tags=None, domains=None):
+        """(precision, recall) of following tags and domains, out of fold
+
+        Each fold's posts only match the tops picked without them (narrowed
+        down to tags and domains, once they've been refined by hand)."""
+        predicted = 0
+        for posts, fold_tags, fold_domains in self.folds:
+            if tags is not None:
+                fold_tags = fold_tags.intersection(tags)
+            if domains is not None:
+                fold_domains = fold_domains.intersection(domains)
+            predicted |= posts & (self.tags_cloud.posts_with(fold_tags) |
+                                  self.domains_cloud.posts_with(fold_domains))
+        liked = self.tags_cloud.liked
+        hits = (predicted & liked).bit_count()
+        return hits / max(predicted.bit_count(), 1), hits / max(liked.bit_count(), 1)
+
     def get_parameters(self):
         ret = super().get_parameters()
         ret['domains'] = self.domains
@@ -113,24 +167,44 @@ class TagModel(BaseModel):
             print("Select the tags you'd like to subscribe to:")
             selections = [t in self.tags for t in self.tags_cloud.tops]
             selections = checklist_prompt(
-                self.tags_cloud.tops, default=selections)
-            self.tags = [self.tags_cloud.tops[i]
-                         for i in range(len(selections)) if selections[i]]
+                self.tags_cloud.tops, default=selections,
+                status=lambda s: self._stats_summary(
+                    self._selected(self.tags_cloud.tops, s), self.domains))
+            self.tags = self._selected(self.tags_cloud.tops, selections)
         if len(self.domains_cloud.tops) > 0:
             print("Please select domains to subscribe to:")
             selections = [d in self.domains for d in self.domains_cloud.tops]
             selections = checklist_prompt(
-                self.domains_cloud.tops, default=selections)
-            self.domains = [self.domains_cloud.tops[i]
-                            for i in range(len(selections)) if selections[i]]
-        self._calculate_stats()
-
-    def _calculate_stats(self):
-        toplikes = set()
-        for tag in self.tags:
-            toplikes.update(self.tags_cloud.likes[tag])
-        for domain in self.domains:
-            toplikes.update(self.domains_cloud.likes[domain])
-        self.precision = float(len(toplikes)) / len(self.tags_cloud.posts_with(self.tags) | self.domains_cloud.posts_with(self.domains))
-        self.recall = float(len(toplikes)) / len(self.corpus.liked)
-        print(f"\nSubscribing to just these would have given you {len(toplikes)}/{int(len(self.corpus.liked))}={100.0*self.recall:.1f}% of the posts you've liked.")
+                self.domains_cloud.tops, default=selections,
+                status=lambda s: self._stats_summary(
+                    self.tags, self._selected(self.domains_cloud.tops, s)))
+            self.domains = self._selected(self.domains_cloud.tops, selections)
+        self._calculate_stats(refined=True)
+
+    @staticmethod
+    def _selected(options, selections):
+        return [options[i] for i in range(len(selections)) if selections[i]]
+
+    def _stats_for(self, tags, domains):
+        """(liked posts with those tags/domains, precision, recall)"""
+        selected = self.tags_cloud.posts_with(tags) | self.domains_cloud.posts_with(domains)
+        liked = self.tags_cloud.liked
+        toplikes = (selected & liked).bit_count()
+        precision = float(toplikes) / max(selected.bit_count(), 1)
+        recall = float(toplikes) / liked.bit_count()
+        return toplikes, precision, recall
+
+    def _stats_summary(self, tags, domains):
+        precision, recall = self._cv_stats(tags, domains)
+        return f"P={precision*100.0:.0f}% R={recall*100:.0f}% => {sqrt(precision*recall)*100:.0f}%"
+
+    def _calculate_stats(self, refined=False):
+        toplikes, _, recall = self._stats_for(self.tags, self.domains)
+        print(f"\nSubscribing to just these would have given you {toplikes}/{self.tags_cloud.liked.bit_count()}={100.0*recall:.1f}% of the posts you've liked.")
+        if refined:
+            self.precision, self.recall = self._cv_stats(self.tags, self.domains)
+        else:
+            # Unrefined, the tags are just whatever each fold would have picked
+            self.precision, self.recall = self._cv_stats()
+        self.accuracy = sqrt(self.precision * self.recall)
+        print(f"Cross-validation predicts an accuracy of P={self.precision*100:.0f}% × R={self.recall*100:.0f}% = {self.accuracy*100:.1f}% for these tags and domains\n")
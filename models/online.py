@@ -0,0 +1,129 @@
+#!/bin/python3
+
+import numpy as np
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from yaspin import yaspin
+
+from .base import BaseModel, Corpus, ModelStatus
+from .evaluation import calibrate
+from .feed import FeedEntry
+from .text import (
+    pretokenized,
+    stemmed_nltk_tokenizer,
+    tokenize_corpus,
+)
+
+from settings import db_dir
+from tracing import span
+
+N_FEATURES = 2**18
+CLASSES = np.array([0.0, 1.0])
+
+
+def _hasher(**kwargs):
+    # Stateless, so the same tokens always land in the same columns
+    # no matter which of these two flavors produced them
+    return HashingVectorizer(
+        n_features=N_FEATURES,
+        alternate_sign=False,
+        **kwargs,
+    )
+
+
+text_hasher = _hasher(
+    tokenizer=stemmed_nltk_tokenizer,
+    lowercase=False,
+    token_pattern=None,
+)
+token_hasher = _hasher(analyzer=pretokenized)
+
+
+class OnlineModel(BaseModel):
+    NAME = "Online Learner"
+    DESCRIPTION = "A logistic regression over hashed words that learns as you read"
+    MIN_DATA = "10 likes and dislikes, and 100 rated posts"
+    MODEL_FNAME = 'online-model.pkl'
+    BATCH_SIZE = 32
+    # The first batch is learned without being scored, so leave plenty after it
+    MIN_RATED = 100
+
+    def __init__(self, corpus: Corpus = None, **kwargs):
+        super().__init__(corpus=corpus, **kwargs)
+        if corpus:
+            if len(corpus.liked) < 10 or len(corpus.disliked) < 10 \
+                    or len(corpus.rated) < self.MIN_RATED:
+                self.status = ModelStatus.Invalid
+        self.cutoff = kwargs.get('cutoff', 0.0)
+        self.model = None
+        self.updates = 0
+        self.model_file = kwargs.get('model_file') or self.MODEL_FNAME
+        if kwargs.get('model_file'):
+            self.model = joblib.load(db_dir.joinpath(self.model_file))
+
+    def get_cutoff(self):
+        return self.cutoff
+
+    def _new_model(self):
+        return SGDClassifier(loss='log_loss', alpha=1e-4, average=True, random_state=0)
+
+    def analyze(self):
+        # Replay the history in the order it was read, scoring each batch
+        # before learning from it, which gives honest out-of-sample scores
+        corpus = self.corpus.rated_chronologically()
+        Y = np.array([1.0 if entry.status == "liked" else 0.0 for entry in corpus])
+        documents = tokenize_corpus(corpus, db_dir)
+        self.model = self._new_model()
+        scores = []
+        with yaspin(text="Replaying your history..."), span('fit', samples=len(corpus)):
+            for i in range(0, len(corpus), self.BATCH_SIZE):
+                X = token_hasher.transform(documents[i:i+self.BATCH_SIZE])
+                y = Y[i:i+self.BATCH_SIZE]
+                if i > 0:
+                    scores.extend(self.model.decision_function(X))
+                self.model.partial_fit(X, y, classes=CLASSES)
+        # The first batch was learned blind, so it has no score
+        Y = Y[self.BATCH_SIZE:]
+        if len(scores) < self.MIN_RATED - self.BATCH_SIZE or not Y.any() or Y.all():
+            self.status = ModelStatus.Invalid
+            print("Too few of your ratings came after the warm-up batch to estimate the accuracy, unfortunately.")
+            return
+        calibration = calibrate(scores, Y)
+        self.cutoff = calibration.cutoff
+        self.accuracy = calibration.accuracy
+        self.precision = calibration.precision
+        self.recall = calibration.recall
+        print(f"Replaying your history predicts an accuracy of P={self.precision*100:.0f}% × R={self.recall*100:.0f}% = {self.accuracy*100:.1f}% at cutoff={self.cutoff}\n")
+        self.status = ModelStatus.Analyzed
+
+    def score(self, post: FeedEntry):
+        return self.score_many([post])[0]
+
+    def score_many(self, posts: list[FeedEntry]):
+        if not posts:
+            return []
+        X = text_hasher.transform([
+            post.get_text_for_training() for post in posts
+        ])
+        return [float(y) for y in self.model.decision_function(X)]
+
+    def update(self, post: FeedEntry):
+        X = text_hasher.transform([post.get_text_for_training()])
+        y = [1.0 if post.status == "liked" else 0.0]
+        if self.model is None:
+            self.model = self._new_model()
+        self.model.partial_fit(X, y, classes=CLASSES)
+        self.updates += 1
+
+    def save_state(self):
+        if self.updates:
+            joblib.dump(self.model, db_dir.joinpath(self.model_file))
+            self.updates = 0
+
+    def get_parameters(self):
+        ret = super().get_parameters()
+        ret['cutoff'] = self.cutoff
+        joblib.dump(self.model, db_dir.joinpath(self.model_file))
+        ret['model_file'] = self.model_file
+        return ret
@@ -0,0 +1,463 @@
+#!/bin/python3
+
+import hashlib
+import json
+import sqlite3
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice
+from pathlib import Path
+
+from .feed import FeedEntry
+
+SQLITE_FNAME = 'entries.sqlite3'
+SCORES_FNAME = 'scores.sqlite3'
+
+
+def _decode_json_file(path: Path) -> dict:
+    return json.loads(path.read_text())
+
+
+def _decode_sqlite_row(row) -> dict:
+    summary, data = row
+    data = json.loads(data)
+    data['summary'] = summary
+    return data
+
+
+class JSONDirStore:
+    """The original layout: one {fbbid}.json file per post in the db_dir"""
+
+    # A post's file has to be read whole anyway, so dropping its summary
+    # would only mean reading the file again when the summary is shown
+    LAZY_SUMMARIES = False
+
+    def __init__(self, db_dir: Path):
+        self.db_dir = db_dir
+
+    def path_for(self, fbbid: str) -> Path:
+        return self.db_dir.joinpath(f"{fbbid}.json")
+
+    def __contains__(self, fbbid: str):
+        return self.path_for(fbbid).exists()
+
+    def load(self, fbbid: str, lazy: bool = False) -> FeedEntry:
+        """Loads the post, summary included (see LAZY_SUMMARIES)"""
+        return FeedEntry(json_file=self.path_for(fbbid), store=self)
+
+    def load_summary(self, fbbid: str) -> str:
+        return _decode_json_file(self.path_for(fbbid)).get('summary')
+
+    def save(self, entry: FeedEntry):
+        self.path_for(entry.fbbid).write_text(entry.json())
+
+    def save_many(self, entries):
+        for entry in entries:
+            self.save(entry)
+
+    def entries(self, statuses: list[str] = None, lazy: bool = False):
+        for fd in self.sources():
+            entry = FeedEntry(json_file=fd, store=self)
+            if not statuses or entry.status in statuses:
+                yield entry
+
+    def sources(self, lazy: bool = False):
+        """The raw records (here, file paths) to be passed to decode"""
+        for fd in self.db_dir.iterdir():
+            if fd.name.endswith('.json'):
+                yield fd
+
+    decode = staticmethod(_decode_json_file)
+
+    def reopen(self):
+        """A handle on the same store that's safe to use from another thread"""
+        return self
+
+    def close(self):
+        pass
+
+
+class SQLiteStore:
+    """All posts in a single SQLite table, indexed by fbbid and status
+
+    The summary HTML (by far the largest field) gets its own column
+    and everything else is kept as a small JSON blob in `data`."""
+
+    # Lazy entries leave the summary column unread until it's needed
+    LAZY_SUMMARIES = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._connect()
+
+    # Connections can't cross process boundaries, so pickles just reconnect
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._connect()
+
+    def _connect(self):
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            fbbid TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            timestamp INTEGER,
+            summary TEXT,
+            data TEXT NOT NULL
+        )""")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_status ON entries(status)")
+        self.db.commit()
+
+    def __contains__(self, fbbid: str):
+        return self.db.execute(
+            "SELECT 1 FROM entries WHERE fbbid = ?", (fbbid,)
+        ).fetchone() is not None
+
+    def _row_to_entry(self, row) -> FeedEntry:
+        return FeedEntry(data=_decode_sqlite_row(row), store=self)
+
+    @staticmethod
+    def _columns(lazy: bool) -> str:
+        # Lazy entries leave the summary in the db until it's needed
+        return "NULL, data" if lazy else "summary, data"
+
+    def load(self, fbbid: str, lazy: bool = False) -> FeedEntry:
+        row = self.db.execute(
+            f"SELECT {self._columns(lazy)} FROM entries WHERE fbbid = ?",
+            (fbbid,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(fbbid)
+        return self._row_to_entry(row)
+
+    def load_summary(self, fbbid: str) -> str:
+        row = self.db.execute(
+            "SELECT summary FROM entries WHERE fbbid = ?", (fbbid,)
+        ).fetchone()
+        return row and row[0]
+
+    def _row_for(self, entry: FeedEntry):
+        data = entry.to_dict()
+        summary = data.pop('summary')
+        return (entry.fbbid, entry.status, entry.timestamp, summary,
+                json.dumps(data, sort_keys=True))
+
+    def save(self, entry: FeedEntry):
+        self.save_many([entry])
+
+    def save_many(self, entries):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (self._row_for(e) for e in entries))
+
+    def entries(self, statuses: list[str] = None, lazy: bool = False):
+        query = f"SELECT {self._columns(lazy)} FROM entries"
+        params = ()
+        if statuses:
+            query += f" WHERE status IN ({','.join('?' * len(statuses))})"
+            params = tuple(statuses)
+        for row in self.db.execute(query, params):
+            yield self._row_to_entry(row)
+
+    def sources(self, lazy: bool = False):
+        """The raw records (here, table rows) to be passed to decode"""
+        return self.db.execute(f"SELECT {self._columns(lazy)} FROM entries")
+
+    decode = staticmethod(_decode_sqlite_row)
+
+    def reopen(self):
+        # sqlite3 connections can only be used by the thread that made them
+        return SQLiteStore(self.path)
+
+    def close(self):
+        self.db.close()
+
+
+def _decode_chunk(decode, chunk: list, lazy: bool) -> list[dict]:
+    ret = [decode(source) for source in chunk]
+    if lazy:
+        for data in ret:
+            data.pop('summary', None)
+    return ret
+
+
+def load_entries(store, workers: int = 0, processes: bool = False,
+                 chunksize: int = 256, lazy: bool = False):
+    """Yields every entry in store as soon as it has been decoded
+
+    With workers=0 this is just store.entries(). Otherwise the raw records
+    are handed out in chunks to a pool of threads (or processes) and the
+    decoded entries are yielded in whatever order the chunks finish.
+    Lazy entries fetch their summary from the store only when it's read
+    (in stores with LAZY_SUMMARIES; the rest load it up front)."""
+    lazy = lazy and store.LAZY_SUMMARIES
+    if not workers:
+        yield from store.entries(lazy=lazy)
+        return
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    sources = iter(store.sources(lazy=lazy))
+    with Executor(max_workers=workers) as pool:
+        pending = set()
+        while True:
+            # Keep a couple of chunks queued per worker without
+            # reading the whole source list into memory up front
+            while len(pending) < 2 * workers:
+                chunk = list(islice(sources, chunksize))
+                if not chunk:
+                    break
+                pending.add(pool.submit(
+                    _decode_chunk, store.decode, chunk, lazy))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for data in future.result():
+                    yield FeedEntry(data=data, store=store)
+
+
+class WriteBehind:
+    """Saves rated entries (and drops them from the unread set) off the UI thread
+
+    Ratings are queued and written in batches every `interval` seconds
+    by a background thread, so a crash loses at most that many seconds
+    of ratings. Rating the same entry twice before a flush writes it once.
+    With interval=0 every rating is written before save() returns.
+    Always close() (or use it as a context manager) to flush what's left."""
+
+    def __init__(self, store, unread, interval: float = 0):
+        self.store = store
+        self.unread = unread
+        self.interval = interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closing = False
+        self.thread = None
+        if interval > 0:
+            self.thread = threading.Thread(
+                target=self._run, name="WriteBehind", daemon=True)
+            self.thread.start()
+
+    def save(self, entry: FeedEntry):
+        """Persists entry and removes it from the unread set"""
+        if not self.thread:
+            entry.save()
+            self.unread.remove(entry)
+            return
+        # Lazy summaries must be fetched on this thread's connection
+        entry.summary
+        with self.lock:
+            self.pending[entry.fbbid] = entry
+
+    def _run(self):
+        store = self.store.reopen()
+        try:
+            while not self.closing:
+                self.wake.wait(self.interval)
+                self._flush(store)
+        finally:
+            if store is not self.store:
+                store.close()
+
+    def _flush(self, store):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        try:
+            store.save_many(batch.values())
+            for entry in batch.values():
+                self.unread.remove(entry)
+        except Exception as e:
+            print(f"WARNING: Couldn't save {len(batch)} ratings ({e}). Will retry.")
+            with self.lock:
+                # Anything rated again since is newer than what we failed to save
+                self.pending = {**batch, **self.pending}
+
+    def close(self):
+        if self.thread:
+            self.closing = True
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+        if self.pending:
+            self._flush(self.store)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Prefetcher:
+    """Gets the next few entries ready on a background thread while the user reads
+
+    Call advance(i) when entries[i] goes on screen, and the following
+    `lookahead` entries will have their summaries loaded and links
+    parsed (and optionally their training text built) before they're needed."""
+
+    def __init__(self, entries: list, store=None, lookahead: int = 5,
+                 training_text: bool = False):
+        self.entries = entries
+        self.store = store
+        self.lookahead = lookahead
+        self.training_text = training_text
+        self.position = -1
+        # The next index the worker will prefetch
+        self.next = 0
+        self.closing = False
+        self.changed = threading.Condition()
+        self.thread = None
+        if lookahead > 0 and entries:
+            self.thread = threading.Thread(
+                target=self._run, name="Prefetcher", daemon=True)
+            self.thread.start()
+
+    def advance(self, position: int):
+        with self.changed:
+            self.position = position
+            self.changed.notify()
+
+    def _ready(self) -> bool:
+        return self.closing or (
+            self.next < len(self.entries) and
+            self.next <= self.position + self.lookahead)
+
+    def _run(self):
+        store = self.store.reopen() if self.store else None
+        try:
+            while True:
+                with self.changed:
+                    self.changed.wait_for(self._ready)
+                    if self.closing:
+                        return
+                    # No point preparing what's already been shown
+                    i = max(self.next, self.position + 1)
+                    self.next = i + 1
+                if i >= len(self.entries):
+                    continue
+                try:
+                    self.entries[i].prefetch(store, self.training_text)
+                except Exception:
+                    # Only an optimization: the UI will compute it again itself
+                    pass
+        finally:
+            if store is not None and store is not self.store:
+                store.close()
+
+    def close(self):
+        if self.thread:
+            with self.changed:
+                self.closing = True
+                self.changed.notify()
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScoreStore:
+    """Model scores for unread posts, worked out ahead of time by refresh.py
+
+    Each score is filed under the key of the model that produced it, so
+    re-running analyze.py (or the online model learning) hides the old
+    ones rather than the reader trusting them."""
+
+    CHUNK_SIZE = 500
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS scores (
+            fbbid TEXT NOT NULL,
+            model TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (model, fbbid)
+        )""")
+        self.db.commit()
+
+    @staticmethod
+    def key_for(algo: str, params: dict, db_dir: Path) -> str:
+        """Identifies a trained model by its settings and the files they point at"""
+        key = [algo, params]
+        # e.g. the online model's model_file changes every time it learns
+        for name, value in sorted((params or {}).items()):
+            if name.endswith(('_file', '_dir')) and db_dir.joinpath(value).exists():
+                key.append([value, db_dir.joinpath(value).stat().st_mtime_ns])
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+
+    def get_many(self, model: str, fbbids: list[str]) -> dict[str, float]:
+        ret = {}
+        fbbids = list(fbbids)
+        for i in range(0, len(fbbids), self.CHUNK_SIZE):
+            chunk = fbbids[i:i + self.CHUNK_SIZE]
+            ret.update(self.db.execute(
+                f"SELECT fbbid, score FROM scores WHERE model = ? AND fbbid IN ({','.join('?' * len(chunk))})",
+                (model, *chunk)))
+        return ret
+
+    def save_many(self, model: str, scores: dict[str, float]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?)",
+                ((fbbid, model, score) for fbbid, score in scores.items()))
+
+    def prune(self, model: str, keep: set[str]) -> int:
+        """Forgets other models' scores and those of posts no longer in keep"""
+        with self.db:
+            ret = self.db.execute(
+                "DELETE FROM scores WHERE model != ?", (model,)).rowcount
+            stale = [(model, fbbid) for (fbbid,) in self.db.execute(
+                "SELECT fbbid FROM scores WHERE model = ?", (model,)
+            ) if fbbid not in keep]
+            self.db.executemany(
+                "DELETE FROM scores WHERE model = ? AND fbbid = ?", stale)
+        return ret + len(stale)
+
+    def close(self):
+        self.db.close()
+
+
+def open_store(db_dir: Path, kind: str = None):
+    """Opens the entry store named in settings.yaml (default: json)"""
+    match kind or 'json':
+        case 'json':
+            return JSONDirStore(db_dir)
+        case 'sqlite':
+            return SQLiteStore(db_dir.joinpath(SQLITE_FNAME))
+    raise ValueError(f"Unknown entry store \"{kind}\". Expected json or sqlite.")
+
+
+def migrate_json_dir(db_dir: Path, store, batch_size=1000) -> int:
+    """Copies every {fbbid}.json post in db_dir into store
+
+    Returns the number of posts copied.
+    The JSON files themselves are left untouched as a backup."""
+    count = 0
+    batch = []
+    for entry in JSONDirStore(db_dir).entries():
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            store.save_many(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        store.save_many(batch)
+        count += len(batch)
+    return count
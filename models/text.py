@@ -0,0 +1,175 @@
+#!/bin/python3
+
+import hashlib
+import json
+import os
+import sqlite3
+from functools import cache
+from pathlib import Path
+
+from yaspin import yaspin
+
+from .feed import FeedEntry
+
+from tracing import span
+
+# Bump this whenever stemmed_nltk_tokenizer or
+# FeedEntry.get_text_for_training change their output
+TOKENIZER_VERSION = 1
+TOKEN_CACHE_FNAME = 'tokens.sqlite3'
+# Not .json, or the JSON entry store would take it for a post
+STEM_MEMO_FNAME = 'stems.memo'
+
+
+class StemMemo:
+    """A bounded token -> stem table in front of the Snowball stemmer
+
+    Word frequencies are Zipfian, so the first few tens of thousands of
+    distinct tokens we see cover nearly every occurrence. Once the table
+    is full, new tokens are simply stemmed without being remembered."""
+
+    def __init__(self, stem, maxsize: int = 100000):
+        self._stem = stem
+        self.maxsize = maxsize
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+
+    def stem(self, token: str) -> str:
+        ret = self.table.get(token)
+        if ret is not None:
+            self.hits += 1
+            return ret
+        self.misses += 1
+        ret = self._stem(token)
+        if len(self.table) < self.maxsize:
+            self.table[token] = ret
+        return ret
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def load(self, path: Path):
+        if path.exists():
+            data = json.loads(path.read_text())
+            if data.get('version') == TOKENIZER_VERSION:
+                table = data.get('stems', {})
+                self.table.update(
+                    (k, table[k]) for k in list(table)[:self.maxsize - len(self.table)])
+
+    def save(self, path: Path):
+        # Write then rename so a concurrent load never sees half a file
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({
+            'version': TOKENIZER_VERSION,
+            'stems': self.table,
+        }))
+        os.replace(tmp, path)
+
+
+# Importing nltk takes over a second, so wait until something is tokenized
+@cache
+def nltk_stemmer():
+    from nltk.stem.snowball import SnowballStemmer
+    return SnowballStemmer('english')
+
+
+@cache
+def nltk_tokenizer():
+    from nltk.tokenize import NLTKWordTokenizer
+    return NLTKWordTokenizer()
+
+
+stem_memo = StemMemo(lambda token: nltk_stemmer().stem(token))
+def stemmed_nltk_tokenizer(s):
+    tokens = nltk_tokenizer().tokenize(s)
+    tokens = [t[:-1] if t.endswith('.') else t for t in tokens]
+    stem = stem_memo.stem
+    return [stem(token) for token in tokens]
+
+
+def pretokenized(tokens):
+    """An analyzer for vectorizers fed the output of TokenCache.tokens_for"""
+    return tokens
+
+
+def content_hash(entry: FeedEntry) -> str:
+    """Hashes the fields that get_text_for_training depends on"""
+    content = json.dumps([entry.title, entry.summary, entry.tags])
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    """Persists each post's training text and stemmed tokens between runs
+
+    Rows are keyed by fbbid and only trusted if both the post's content
+    hash and the TOKENIZER_VERSION still match."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Models analyzing in parallel may be writing at the same time
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tokens (
+            fbbid TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            tokens TEXT NOT NULL
+        )""")
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached_rows(self, fbbids: list[str]) -> dict:
+        ret = {}
+        # Stay well under SQLite's limit on the number of ? parameters
+        for i in range(0, len(fbbids), 500):
+            chunk = fbbids[i:i+500]
+            ret.update({row[0]: row[1:] for row in self.db.execute(
+                f"SELECT fbbid, hash, version, tokens FROM tokens WHERE fbbid IN ({','.join('?' * len(chunk))})",
+                chunk)})
+        return ret
+
+    def tokens_for(self, entries: list[FeedEntry]) -> list[list[str]]:
+        """Returns each entry's stemmed tokens, tokenizing only the new or changed ones"""
+        cached = self._cached_rows([entry.fbbid for entry in entries])
+        ret = []
+        updates = []
+        for entry in entries:
+            digest = content_hash(entry)
+            row = cached.get(entry.fbbid)
+            if row and row[0] == digest and row[1] == TOKENIZER_VERSION:
+                self.hits += 1
+                ret.append(json.loads(row[2]))
+                continue
+            self.misses += 1
+            text = entry.get_text_for_training()
+            tokens = stemmed_nltk_tokenizer(text)
+            ret.append(tokens)
+            updates.append((entry.fbbid, digest, TOKENIZER_VERSION, text, json.dumps(tokens)))
+        if updates:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?)",
+                    updates)
+        return ret
+
+    def close(self):
+        self.db.close()
+
+
+def tokenize_corpus(entries: list[FeedEntry], cache_dir: Path) -> list[list[str]]:
+    """Stemmed tokens for each entry, using (and updating) the on-disk caches"""
+    with yaspin(text="Tokenizing..."), span('tokenize', posts=len(entries)):
+        stem_memo.load(cache_dir.joinpath(STEM_MEMO_FNAME))
+        token_cache = TokenCache(cache_dir.joinpath(TOKEN_CACHE_FNAME))
+        documents = token_cache.tokens_for(entries)
+        token_cache.close()
+        if token_cache.misses:
+            stem_memo.save(cache_dir.joinpath(STEM_MEMO_FNAME))
+    print(f"Tokenized {token_cache.misses} new or changed posts ({token_cache.hits} were cached)")
+    if stem_memo.hits + stem_memo.misses:
+        print(f"Stem memo hit rate: {stem_memo.hit_rate*100:.1f}% ({len(stem_memo.table)} stems)")
+    return documents
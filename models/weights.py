@@ -0,0 +1,118 @@
+#!/bin/python3
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .text import stemmed_nltk_tokenizer
+
+FORMAT_VERSION = 1
+ARRAYS = ('vocabulary', 'idf', 'coef')
+
+
+def _array_path(directory: Path, name: str, generation: str = None) -> Path:
+    # Weights saved before generations existed have plain names
+    return directory.joinpath(f"{name}.{generation}.npy" if generation else f"{name}.npy")
+
+
+def _save_npy(path: Path, array: np.ndarray):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as fd:
+        np.save(fd, array, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+class LinearWeights:
+    """A trained TF-IDF + linear model reduced to three flat arrays
+
+    The vocabulary is a sorted array of fixed-width strings, so looking up
+    a term is a binary search and the whole thing can be memory-mapped
+    straight from disk without unpickling anything."""
+
+    def __init__(self, vocabulary: np.ndarray, idf: np.ndarray,
+                 coef: np.ndarray, intercept: float):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.coef = coef
+        self.intercept = intercept
+
+    @classmethod
+    def from_sklearn(cls, vectorizer, model):
+        """Extracts the weights from a fitted TfidfVectorizer and linear classifier"""
+        vocabulary = np.array(vectorizer.get_feature_names_out(), dtype=str)
+        idf = np.asarray(vectorizer.idf_, dtype=np.float64)
+        coef = np.asarray(model.coef_, dtype=np.float64).reshape(-1)
+        order = np.argsort(vocabulary)
+        return cls(vocabulary[order], idf[order], coef[order],
+                   float(np.asarray(model.intercept_).reshape(-1)[0]))
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True):
+        """Loads the arrays named by meta.json, which are always a matching set"""
+        mode = 'r' if mmap else None
+        for attempt in range(3):
+            meta = json.loads(directory.joinpath('meta.json').read_text())
+            if meta.get('format') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported linear weights format {meta.get('format')}")
+            try:
+                arrays = [
+                    np.load(_array_path(directory, name, meta.get('generation')),
+                            mmap_mode=mode, allow_pickle=False)
+                    for name in ARRAYS
+                ]
+            except FileNotFoundError:
+                # A save just replaced this generation, so read the new meta.json
+                if attempt == 2:
+                    raise
+                continue
+            return cls(*arrays, meta['intercept'])
+
+    def save(self, directory: Path):
+        """Writes a new generation of arrays, then points meta.json at it
+
+        Replacing meta.json is atomic, so a concurrent load (say, by
+        refresh.py) sees either all the old arrays or all the new ones."""
+        directory.mkdir(exist_ok=True)
+        generation = f"{time.time_ns():x}{os.getpid():x}"
+        for name in ARRAYS:
+            _save_npy(_array_path(directory, name, generation), getattr(self, name))
+        tmp = directory.joinpath(f"meta.json.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({
+            'format': FORMAT_VERSION,
+            'generation': generation,
+            'intercept': self.intercept,
+        }))
+        os.replace(tmp, directory.joinpath('meta.json'))
+        # Readers that already have the old arrays mmapped keep them until they're done
+        for path in directory.glob('*.npy'):
+            if path.name.split('.')[1:] != [generation, 'npy']:
+                path.unlink(missing_ok=True)
+
+    def decision_function_tokens(self, documents: list[list[str]]) -> np.ndarray:
+        """Scores the whole batch at once, like one sparse TF-IDF matrix × coef"""
+        ret = np.full(len(documents), self.intercept)
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.int64)
+        if len(self.vocabulary) == 0 or not lengths.any():
+            return ret
+        tokens = np.array([t for tokens in documents for t in tokens], dtype=str)
+        rows = np.repeat(np.arange(len(documents)), lengths)
+        columns = np.searchsorted(self.vocabulary, tokens)
+        columns[columns == len(self.vocabulary)] = 0
+        known = self.vocabulary[columns] == tokens
+        # Count each (post, term) pair, as the nonzeros of a CSR matrix would
+        cells, counts = np.unique(
+            rows[known] * len(self.vocabulary) + columns[known], return_counts=True)
+        rows, columns = np.divmod(cells, len(self.vocabulary))
+        # Same weighting as TfidfVectorizer: raw counts × idf, then L2 normalized
+        tfidf = counts * self.idf[columns]
+        dots = np.bincount(rows, weights=tfidf * self.coef[columns], minlength=len(documents))
+        norms = np.sqrt(np.bincount(rows, weights=tfidf * tfidf, minlength=len(documents)))
+        np.divide(dots, norms, out=dots, where=norms > 0)
+        return ret + dots
+
+    def decision_function(self, texts: list[str]) -> np.ndarray:
+        return self.decision_function_tokens(
+            [stemmed_nltk_tokenizer(text) for text in texts])
@@ -0,0 +1,115 @@
+#!/bin/python3
+"""Fetches new posts and scores them ahead of time, so main.py opens a ready-ranked queue
+
+Run it from cron (e.g. every half hour):
+    */30 * * * * cd /path/to/feedburnerburner && python3 refresh.py --quiet
+or leave it running in the background:
+    python3 refresh.py --daemon [--interval MINUTES]"""
+
+import argparse
+import time
+from datetime import datetime
+
+import yaml
+
+import main
+from main import (
+    _load_model,
+    fetch_new_entries,
+    load_unread,
+    model_key,
+)
+from models.store import (
+    SCORES_FNAME,
+    ScoreStore,
+    open_store,
+)
+from settings import (
+    settings,
+    SETTINGS_FILE,
+    unread_entries,
+    db_dir,
+)
+
+import tracing
+from tracing import span
+
+DEFAULT_INTERVAL = 30
+
+
+def log(message: str):
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {message}", flush=True)
+
+
+def reload_settings():
+    """Picks up whatever analyze.py, migrate.py and the reader have saved since last time"""
+    store = settings.get('store')
+    settings.clear()
+    if SETTINGS_FILE.exists():
+        settings.update(yaml.safe_load(SETTINGS_FILE.read_text()))
+    if settings.get('store') != store:
+        # e.g. migrate.py moved the posts into SQLite, so save new ones there too
+        main.entry_store.close()
+        main.entry_store = open_store(db_dir, settings.get('store'))
+        log(f"Switched to the {settings.get('store') or 'json'} entry store")
+    unread_entries.reload()
+
+
+def refresh(scores: ScoreStore, quiet: bool = False):
+    with span('refresh'):
+        reload_settings()
+        new_entries = fetch_new_entries()
+        if new_entries or not quiet:
+            log(f"Fetched {len(new_entries)} new posts")
+        with span('load model', algo=settings.get('algo')):
+            model = _load_model() if SETTINGS_FILE.exists() else None
+        if not model:
+            return
+        key = model_key()
+        unread_items = load_unread()
+        known = scores.get_many(key, [entry.fbbid for entry in unread_items])
+        unscored = [entry for entry in unread_items if entry.fbbid not in known]
+        with span('score', model=model.NAME, posts=len(unscored)):
+            scores.save_many(key, {
+                entry.fbbid: score
+                for entry, score in zip(unscored, model.score_many(unscored))
+            })
+        scores.prune(key, {entry.fbbid for entry in unread_items})
+        if unscored or not quiet:
+            log(f"Scored {len(unscored)} posts ({len(unread_items)} unread)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--daemon', action='store_true',
+                        help="Keep running, refreshing every --interval minutes")
+    parser.add_argument('--interval', type=float, metavar='MINUTES',
+                        help=f"How long the daemon waits between refreshes (default: refresh_interval in settings.yaml, or {DEFAULT_INTERVAL})")
+    parser.add_argument('--quiet', action='store_true',
+                        help="Only print when there was something new (handy under cron)")
+    tracing.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    tracing.enable_from_args(args)
+    scores = ScoreStore(db_dir.joinpath(SCORES_FNAME))
+    try:
+        while True:
+            try:
+                refresh(scores, args.quiet)
+            except Exception as e:
+                if not args.daemon:
+                    raise
+                # A flaky feed or a half-written settings file shouldn't kill the daemon
+                log(f"ERROR: {e!r}")
+            if not args.daemon:
+                break
+            interval = args.interval or settings.get('refresh_interval', DEFAULT_INTERVAL)
+            time.sleep(60 * interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scores.close()
+        main.entry_store.close()
@@ -0,0 +1,103 @@
+#!/bin/python3
+"""fetch_feed against a stand-in feed server on localhost
+
+python -m pytest tests (or python -m unittest discover tests)"""
+
+import json
+import socket
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import feeds
+from feeds import FeedCache, fetch_feed
+
+FEED_XML = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Stand-in</title>
+<item><title>First post</title><link>http://example.com/1</link><guid>http://example.com/1</guid></item>
+</channel></rss>"""
+ETAG = '"v1"'
+LAST_MODIFIED = 'Sun, 18 Oct 2026 09:00:00 GMT'
+
+
+class StandInFeed(BaseHTTPRequestHandler):
+    """Serves FEED_XML, or a 304 if the client already has this version"""
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(FEED_XML)))
+        self.end_headers()
+        self.wfile.write(FEED_XML)
+
+    def log_message(self, *args):
+        pass
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FetchFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInFeed)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/feed.xml"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = FeedCache(Path(self.tmp.name), 'standin')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_200_saves_the_feed_and_its_validators(self):
+        parsed = fetch_feed(self.url, self.cache, timeout=5)
+        self.assertEqual(parsed.entries[0].title, 'First post')
+        self.assertEqual(self.cache.load_raw(), FEED_XML)
+        self.assertFalse(self.cache.meta_path.exists())
+        self.cache.commit()
+        meta = json.loads(self.cache.meta_path.read_text())
+        self.assertEqual(meta, {'etag': ETAG, 'modified': LAST_MODIFIED})
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+
+    def test_uncommitted_fetch_is_not_conditional(self):
+        # e.g. the reader was killed before it saved the new posts
+        fetch_feed(self.url, self.cache, timeout=5)
+        parsed = fetch_feed(self.url, FeedCache(Path(self.tmp.name), 'standin'), timeout=5)
+        self.assertEqual(parsed.entries[0].title, 'First post')
+        self.assertNotIn('If-None-Match', self.server.requests[1])
+
+    def test_304_returns_none_without_parsing(self):
+        fetch_feed(self.url, self.cache, timeout=5)
+        self.cache.commit()
+        with mock.patch.object(feeds.feedparser, 'parse') as parse:
+            self.assertIsNone(fetch_feed(self.url, self.cache, timeout=5))
+            parse.assert_not_called()
+        self.assertEqual(self.server.requests[1].get('If-None-Match'), ETAG)
+        self.assertEqual(self.server.requests[1].get('If-Modified-Since'), LAST_MODIFIED)
+
+    def test_unreachable_host_falls_back_to_the_cache(self):
+        fetch_feed(self.url, self.cache, timeout=5)
+        offline = f"http://127.0.0.1:{unused_port()}/feed.xml"
+        with mock.patch('builtins.print'):
+            parsed = fetch_feed(offline, self.cache, timeout=5)
+        self.assertEqual(parsed.entries[0].title, 'First post')
+
+
+if __name__ == '__main__':
+    unittest.main()
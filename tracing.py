@@ -0,0 +1,123 @@
+#!/bin/python3
+"""Lightweight timing spans, saved as a Chrome trace
+
+Spans do nothing until enable() is called (by the --profile flag).
+Open the saved trace in chrome://tracing or https://ui.perfetto.dev"""
+
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+DEFAULT_TRACE_FILE = 'trace.json'
+
+# None while tracing is off
+_events = None
+_trace_file = None
+_profile_stage = None
+_profiles = []
+_lock = threading.Lock()
+
+
+def enable(trace_file: Path = DEFAULT_TRACE_FILE, profile_stage: str = None):
+    """Starts recording spans, to be saved to trace_file at exit
+
+    Every span named profile_stage is also run under cProfile, and the
+    combined stats are saved next to the trace and summarized at exit."""
+    global _events, _trace_file, _profile_stage
+    _events = []
+    _trace_file = Path(trace_file)
+    _profile_stage = profile_stage
+    atexit.register(save)
+
+
+def add_arguments(parser):
+    """Adds the --profile and --profile-stage flags to an ArgumentParser"""
+    parser.add_argument(
+        '--profile', nargs='?', const=DEFAULT_TRACE_FILE, metavar='TRACE_FILE',
+        help=f"Time each stage and save a Chrome trace (default: {DEFAULT_TRACE_FILE})")
+    parser.add_argument(
+        '--profile-stage', metavar='STAGE',
+        help="Also run the named stage (e.g. fit, rank, fetch) under cProfile")
+
+
+def enable_from_args(args):
+    if args.profile or args.profile_stage:
+        enable(args.profile or DEFAULT_TRACE_FILE, args.profile_stage)
+
+
+def is_enabled() -> bool:
+    return _events is not None
+
+
+@contextmanager
+def span(name: str, **args):
+    """Times the enclosed block as a stage called name
+
+    Any keyword arguments are shown alongside the span in the trace viewer."""
+    if _events is None:
+        yield
+        return
+    profiler = None
+    if name == _profile_stage:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started_at = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        ended_at = time.perf_counter_ns()
+        if profiler:
+            profiler.disable()
+        with _lock:
+            if profiler:
+                _profiles.append(profiler)
+            _events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': started_at / 1000,
+                'dur': (ended_at - started_at) / 1000,
+                'pid': os.getpid(),
+                'tid': threading.get_native_id(),
+                'args': args,
+            })
+
+
+def drain() -> list:
+    """Removes and returns the spans recorded so far (e.g. to send them to another process)"""
+    if _events is None:
+        return []
+    with _lock:
+        ret = list(_events)
+        _events.clear()
+    return ret
+
+
+def merge(events: list):
+    """Adds spans recorded by another process"""
+    if _events is None:
+        return
+    with _lock:
+        _events.extend(events)
+
+
+def save():
+    if _events is None:
+        return
+    with _lock:
+        _trace_file.write_text(json.dumps({
+            'traceEvents': _events,
+            'displayTimeUnit': 'ms',
+        }))
+        print(f"Saved {len(_events)} spans to {_trace_file}")
+        if _profiles:
+            profile_file = _trace_file.with_suffix(f".{_profile_stage}.prof")
+            stats = pstats.Stats(*_profiles)
+            stats.dump_stats(profile_file)
+            print(f"Saved the profile of \"{_profile_stage}\" to {profile_file}:")
+            stats.sort_stats('cumulative').print_stats(15)
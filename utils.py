@@ -2,6 +2,7 @@
 # A local copy of buddhist-uni.github.io/scripts/strutils.py
 # minus the obu-specific stuff at the end of the file
 
+import fcntl
 import random
 import sys
 import termios
@@ -12,6 +13,7 @@ import string
 import readline
 from pathlib import Path
 from functools import reduce
+from contextlib import contextmanager
 try:
     from titlecase import titlecase
 except BaseException:
@@ -119,7 +121,11 @@ def stdout_make_room(lines: int):
     return 0
 
 
-def checklist_prompt(options: list[str], default=False):
+def checklist_prompt(options: list[str], default=False, status=None):
+    """Lets the user toggle each option on or off
+
+    If given, status(selections) is shown under the list and
+    redrawn every time a box is toggled."""
     selections = []
     if isinstance(default, list):
         selections = default[:len(options)] + [False] * \
@@ -129,12 +135,13 @@ def checklist_prompt(options: list[str], default=False):
     tsize = os.get_terminal_size()
     length = len(options)
     i = 0
-    room = min(tsize.lines - 2, length) + 1
+    status_lines = 1 if status else 0
+    room = min(tsize.lines - 2 - status_lines, length) + 1
     r = (0, room - 1)
     space = tsize.columns - 6
     options = [trunc(t, space) for t in options]
     stdin = sys.stdin.fileno()
-    stdout_make_room(room)
+    stdout_make_room(room + status_lines)
     old_settings = termios.tcgetattr(stdin)
     tty.setraw(stdin)
     try:
@@ -158,6 +165,9 @@ def checklist_prompt(options: list[str], default=False):
             else:
                 cout("  ")
             cout("Accept")
+            if status:
+                cout(ANSI_RETURN_N_DOWN(1))
+                cout(f"{ANSI_COLOR_DIM}{trunc(status(selections), tsize.columns - 1)}{ANSI_COLOR_RESET}")
             ch = sys.stdin.read(1)
             if ch == '\x03':
                 raise KeyboardInterrupt()
@@ -186,7 +196,7 @@ def checklist_prompt(options: list[str], default=False):
                         i = 0
                         r = (0, room - 1)
     finally:
-        cout(f"{ANSI_RESTORE_POSITION}{ANSI_RETURN_N_DOWN(room)}\n")
+        cout(f"{ANSI_RESTORE_POSITION}{ANSI_RETURN_N_DOWN(room + status_lines)}\n")
         termios.tcsetattr(stdin, termios.TCSADRAIN, old_settings)
     return selections
 
@@ -331,39 +341,106 @@ def system_open(filepath):
 
 
 class FileSyncedSet:
+    """A set of strings backed by an append-only log file
+
+    Each line of the file is either an item that was added or, if it
+    starts with a TOMBSTONE, an item that was removed. Once more than
+    half the lines are garbage, the file is rewritten with just the
+    live items and atomically swapped into place.
+
+    Several processes (e.g. the reader and refresh.py) may share the
+    file: writes hold a lock on {fname}.lock, and compaction replays
+    the whole log first so it keeps the other processes' changes."""
+
+    TOMBSTONE = "\t"
+    MIN_GARBAGE_TO_COMPACT = 1000
+
     def __init__(self, fname, normalizer=None):
         self.fname = fname
+        self.lock_fname = f"{fname}.lock"
+        # normalizer must return a string with no newlines or leading tab
+        self.norm = normalizer or (lambda a: str(a).replace("\n", " ").lstrip("\t"))
+        self.reload()
+
+    def reload(self):
+        """Replays the file, picking up changes made by other processes"""
         self.items = set()
-        # normalizer must return a string with no newlines
-        self.norm = normalizer or (lambda a: str(a).replace("\n", " "))
-        if os.path.exists(fname):
-            with open(fname) as fd:
+        # Lines in the file that aren't a live item
+        self.garbage = 0
+        if os.path.exists(self.fname):
+            with open(self.fname) as fd:
                 for l in fd:
-                    l = l[:-1]
-                    self.items.add(l) if l else None
+                    l = l.rstrip("\n")
+                    if not l:
+                        continue
+                    if l.startswith(self.TOMBSTONE):
+                        l = l[len(self.TOMBSTONE):]
+                        if l in self.items:
+                            self.items.remove(l)
+                            # Both the tombstone and the line it buried
+                            self.garbage += 2
+                        else:
+                            self.garbage += 1
+                    elif l in self.items:
+                        self.garbage += 1
+                    else:
+                        self.items.add(l)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_fname, "a") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
 
     def add(self, item):
         item = self.norm(item)
         if item not in self.items:
             self.items.add(item)
-            with open(self.fname, "a") as fd:
-                fd.write(f"{item}\n")
+            self._append(item)
 
     def remove(self, item):
         item = self.norm(item)
         if item not in self.items:
             return
         self.items.remove(item)
-        self._rewrite_file()
+        self._bury(item)
+
+    def _append(self, line):
+        with self._locked(), open(self.fname, "a") as fd:
+            fd.write(f"{line}\n")
+
+    def _bury(self, item):
+        self._append(self.TOMBSTONE + item)
+        self.garbage += 2
+        if self.garbage > max(self.MIN_GARBAGE_TO_COMPACT, len(self.items)):
+            self.compact()
+
+    def compact(self):
+        """Rewrites the file with only the live items"""
+        with self._locked():
+            self.reload()
+            self._rewrite_file()
+        self.garbage = 0
 
     def _rewrite_file(self):
-        with open(self.fname, "w") as fd:
+        # Write then rename, so a crash leaves either the old file or the new
+        tmp = f"{self.fname}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fd:
             for item in self.items:
                 fd.write(f"{item}\n") if item else None
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp, self.fname)
 
     def delete_file(self):
         os.remove(self.fname)
+        if os.path.exists(self.lock_fname):
+            os.remove(self.lock_fname)
         self.items = set()
+        self.garbage = 0
 
     def peak(self):
         ret = self.items.pop()
@@ -372,7 +449,7 @@ class FileSyncedSet:
 
     def pop(self):
         ret = self.items.pop()
-        self._rewrite_file()
+        self._bury(ret)
         return ret
 
     def __len__(self):